@@ -0,0 +1,105 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import sys
+import os
+import re
+import runpy
+import argparse
+import subprocess
+
+#---------------------------------------------------------------------
+#SUBCOMMANDS
+#---------------------------------------------------------------------
+
+# One entry point for the scripts. Each subcommand runs its script as
+# __main__ with the remaining arguments, so `dscribe_tools basic ...` behaves
+# exactly like `python soap_basic.py ...`. Only the chosen script is loaded,
+# and the scripts and helper modules import pandas, dscribe, ase.io, sklearn
+# and scipy.spatial inside the code paths that use them, so a run pays only
+# for what it touches.
+
+COMMANDS = {
+    'basic': ('soap_basic', "pairwise AVERAGE kernel of the first n CIF files in a directory"),
+    'param-test': ('soap_param_test', "SOAP creation time and size across rcut, nmax and lmax"),
+    'stability': ('soap_stability_test', "AVERAGE and REMatch kernel stability between two structures"),
+    'sequential': ('soap_sequential_stability', "kernel match between successive rcut, nmax and lmax values"),
+    'shard': ('soap_shard', "sharded AVERAGE kernel: plan, work, merge"),
+    'bench': ('soap_bench', "benchmark SOAP and kernel timings"),
+    'server': ('soap_server', "long-lived similarity server over a reference set, and its client"),
+    'query': ('soap_query', "nearest reference structures to query CIFs from a similarity index"),
+}
+
+
+def run_command(command, argv):
+    module = COMMANDS[command][0]
+    sys.argv = [module + '.py'] + list(argv)
+    runpy.run_module(module, run_name = '__main__', alter_sys = True)
+
+#---------------------------------------------------------------------
+#IMPORT-TIME REPORT
+#---------------------------------------------------------------------
+
+# `--import-time` reruns the command under `python -X importtime`, which logs
+# the self and cumulative microseconds of every module import to stderr. The
+# log is filtered out of the command's own stderr and summarised as the total
+# import time and the slowest top-level imports.
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def parse_importtime(lines):
+    entries = []
+    rest = []
+    for line in lines:
+        match = IMPORTTIME.match(line)
+        if match is None:
+            if not line.startswith('import time:'):
+                rest.append(line)
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        entries.append({'module': name, 'self': int(self_us) / 1e6, 'cumulative': int(cumulative_us) / 1e6,
+                        'depth': (len(indent) - 1) // 2})
+    return entries, rest
+
+
+def import_report(entries, top = 15):
+    roots = [e for e in entries if e['depth'] == 0]
+    total = sum(e['cumulative'] for e in roots)
+    lines = [f"Imported {len(entries)} modules in {total:.3f} seconds"]
+    for e in sorted(roots, key = lambda e: e['cumulative'], reverse = True)[:top]:
+        lines.append(f"  {e['cumulative']:8.3f}  {e['module']}")
+    return "\n".join(lines)
+
+
+def timed_run(command, argv, top = 15):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__), command] + list(argv),
+                          stderr = subprocess.PIPE, text = True)
+    entries, rest = parse_importtime(proc.stderr.splitlines())
+    if rest:
+        print("\n".join(rest), file = sys.stderr)
+    print(import_report(entries, top), file = sys.stderr)
+    return proc.returncode
+
+#---------------------------------------------------------------------
+#SYSTEM PARAMETERS
+#---------------------------------------------------------------------
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "dscribe_tools", description = "SOAP descriptor and kernel tools",
+                                     epilog = "Run `dscribe_tools COMMAND -h` for the options of a command.")
+    parser.add_argument("--import-time", action = "store_true", help = "report the time spent importing modules while running the command")
+    parser.add_argument("--import-top", type = int, default = 15, help = "slowest top-level imports listed by --import-time")
+    parser.add_argument("command", choices = list(COMMANDS), metavar = "COMMAND",
+                        help = "; ".join(f"{c}: {h}" for c, (m, h) in COMMANDS.items()))
+    parser.add_argument("args", nargs = argparse.REMAINDER, help = "arguments of the command")
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        sys.exit(timed_run(args.command, args.args, args.import_top))
+    run_command(args.command, args.args)
+
+
+if __name__ == "__main__":
+    main()
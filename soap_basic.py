@@ -4,25 +4,86 @@
 
 import sys
 import os
+import argparse
+import itertools
 import gemmi
 import time
-import pandas as pd
-from dscribe.descriptors import SOAP
-from dscribe.kernels import AverageKernel
-from ase import Atoms
-from ase.io import read
+import scipy.sparse as sp
+from soap_cache import soap_params, descriptor_bytes
+from soap_parallel import create_descriptors
+from soap_stream import walk_cifs, stream_means
+from soap_kernels import average_vectors, average_kernel, stack_means, concat_means, max_deviation
+from soap_output import FORMATS, missing_dependency, save_kernel, save_sparse_kernel
+from soap_incremental import update_kernel
+from soap_trace import TRACE_FORMATS, Tracer
+from soap_projection import PROJECTIONS, Projection
+from soap_symmetry import site_weights
+from soap_structures import load_structures
+from soap_checkpoint import Checkpoint
+from soap_cascade import candidate_pairs, index_pairs, cascade
+from soap_index import MODES, SimilarityIndex
+from soap_species import discover_species, all_pairs
+from soap_slicer import feature_labels, pair_indices
+from ase.data import atomic_numbers
 
 #---------------------------------------------------------------------
 #SYSTEM PARAMETERS
 #---------------------------------------------------------------------
 
 # Check parameters
-if (len(sys.argv) != 4):
-    print("Must have 3 parameters: input dir, output dir, number of files")
-    sys.exit()
-inputdir = sys.argv[1]
-outputdir = sys.argv[2]
-n = sys.argv[3]
+parser = argparse.ArgumentParser(description = "Pairwise AVERAGE kernel comparison of the first n CIF files in a directory")
+parser.add_argument("inputdir", help = "input directory of CIF files")
+parser.add_argument("outputdir", help = "output directory")
+parser.add_argument("n", help = "number of files")
+parser.add_argument("--workers", type = int, default = 1, help = "processes used to create descriptors")
+parser.add_argument("--chunksize", type = int, default = 1, help = "structures handed to a worker at a time")
+parser.add_argument("--stream", action = "store_true", help = "stream files through SOAP, keeping only each structure's mean vector")
+parser.add_argument("--prefetch", type = int, default = 8, help = "structures parsed ahead in the background (stream mode)")
+parser.add_argument("--memory-limit", type = float, default = None, help = "ceiling in MB on descriptors held in flight (stream mode)")
+parser.add_argument("--tiled", action = "store_true", help = "use the blocked mean-vector kernel engine (always used in stream and sparse mode)")
+parser.add_argument("--block-size", type = int, default = 512, help = "tile size of the blocked kernel engine")
+parser.add_argument("--upper", action = "store_true", help = "only fill the upper triangle of the kernel matrix (uses the blocked engine)")
+parser.add_argument("--kernel-file", default = None, help = "memory-mapped .npy file the kernel is written to (uses the blocked engine)")
+parser.add_argument("--format", choices = FORMATS, default = "csv", help = "output format of the comparison kernel")
+parser.add_argument("--sparse", action = "store_true", help = "keep descriptors and mean vectors as sparse CSR matrices")
+parser.add_argument("--dtype", choices = ["float64", "float32"], default = "float64", help = "precision of descriptor storage and kernel arithmetic (float32 uses the blocked engine)")
+parser.add_argument("--check-accuracy", type = int, default = None, metavar = "N", help = "report the largest deviation of the first N x N kernel entries from a float64 reference")
+parser.add_argument("--project", choices = PROJECTIONS, default = None, help = "project mean vectors to fewer features before the kernel (uses the blocked engine)")
+parser.add_argument("--components", type = int, default = 128, help = "number of projected features")
+parser.add_argument("--project-sample", type = int, default = 1000, help = "structures the projection is fitted on")
+parser.add_argument("--projection-file", default = None, help = "load the projection from this file if it matches, otherwise fit and save it there")
+parser.add_argument("--unique-sites", action = "store_true", help = "describe one atom per symmetry orbit and weight it by multiplicity (uses the blocked engine)")
+parser.add_argument("--species", default = "C,H,O,N", help = "comma separated SOAP species, or 'auto' to collect them from the CIF files")
+parser.add_argument("--compact", action = "store_true", help = "drop the feature blocks of species pairs that never occur in the same file")
+parser.add_argument("--checkpoint", default = None, metavar = "DIR", help = "save mean vectors and finished kernel row blocks to DIR as the run goes (uses the blocked engine)")
+parser.add_argument("--checkpoint-every", type = int, default = 256, help = "structures per saved chunk of mean vectors")
+parser.add_argument("--resume", action = "store_true", help = "continue from the work saved in --checkpoint")
+parser.add_argument("--cascade-top-k", type = int, default = None, metavar = "K", help = "also run REMatch on each structure's K most similar structures by AVERAGE kernel")
+parser.add_argument("--cascade-threshold", type = float, default = None, help = "also run REMatch on every pair with an AVERAGE kernel value at or above this")
+parser.add_argument("--cascade-index", choices = MODES, default = None, help = "take the --cascade-top-k candidates from a similarity index over the mean vectors instead of the kernel")
+parser.add_argument("--incremental", default = None, metavar = "STATE", help = "reuse and update a saved kernel state, only describing new or changed files")
+parser.add_argument("--trace", default = None, help = "write per-stage and per-structure timings to this file")
+parser.add_argument("--trace-format", choices = TRACE_FORMATS, default = "jsonl", help = "JSON lines or Chrome trace (chrome://tracing, Perfetto)")
+parser.add_argument("--profile", default = "", help = "comma separated stages (walk, parse, soap, stream, incremental, kernel, write, cascade) to run under cProfile, dumped to TRACE.<stage>.prof")
+args = parser.parse_args()
+if missing_dependency(args.format):
+    parser.error(missing_dependency(args.format))
+if args.stream and args.incremental:
+    parser.error("--stream cannot be combined with --incremental")
+if args.project and args.incremental:
+    parser.error("--project cannot be combined with --incremental")
+if args.checkpoint and (args.stream or args.incremental):
+    parser.error("--checkpoint cannot be combined with --stream or --incremental")
+if args.incremental and (args.upper or args.kernel_file):
+    parser.error("--upper and --kernel-file use the blocked kernel engine, which --incremental does not")
+cascading = args.cascade_top_k is not None or args.cascade_threshold is not None
+if cascading and (args.stream or args.incremental or args.checkpoint or args.upper):
+    parser.error("the REMatch cascade needs the full descriptors and kernel, it cannot be combined with --stream, --incremental, --checkpoint or --upper")
+if args.cascade_index and (args.cascade_top_k is None or args.cascade_threshold is not None):
+    parser.error("--cascade-index needs --cascade-top-k and cannot be combined with --cascade-threshold")
+inputdir = args.inputdir
+outputdir = args.outputdir
+n = args.n
 
 # Check they are directories
 if not(os.path.isdir(inputdir) & os.path.isdir(outputdir)) :
@@ -34,46 +95,228 @@ if not(os.path.isdir(inputdir) & os.path.isdir(outputdir)) :
 #AND READ INTO LIST
 #---------------------------------------------------------------------
 e = int(n)
-files = list(gemmi.CifWalk(inputdir))[:e]
 
-filename_split = [i.split("/") for i in files]
-names = [str(i[len(i)-1][:-4]) for i in filename_split]
+tracer = Tracer(args.trace, fmt = args.trace_format, profile = [p for p in args.profile.split(",") if p])
+
+# Stream mode walks and parses lazily while descriptors are computed
+if not args.stream:
+    with tracer.stage("walk") as stage:
+        files = list(gemmi.CifWalk(inputdir))[:e]
+        stage['files'] = len(files)
 
-structures = [read(c) for c in files]
+    filename_split = [i.split("/") for i in files]
+    names = [str(i[len(i)-1][:-4]) for i in filename_split]
 
-ns = len(structures)
+    # Incremental mode only parses the files it has not seen before
+    if not args.incremental:
+        with tracer.stage("parse") as stage:
+            structures = load_structures(files)
+            stage['atoms'] = sum(len(s) for s in structures)
+
+    ns = len(files)
 
 
 #---------------------------------------------------------------------
 #INITIATE PERIODIC SOAP DESCRIPTOR
 #---------------------------------------------------------------------
-species = ['C','H','O','N']
+species = args.species.split(",")
 r_cut = 20.0
 nmax = 16
 lmax = 9
 
-t2_per_soap = SOAP(species = species, rcut = r_cut, nmax = nmax, lmax = lmax, periodic= True, sparse = False)
+# One header-only pass over the CIFs finds the dataset's species and the
+# species pairs that share a file
+pairs = None
+if args.species == "auto" or args.compact:
+    found, pairs = discover_species(list(walk_cifs(inputdir, e)) if args.stream else files)
+    if args.species == "auto":
+        species = found
+    z = {atomic_numbers[s] for s in species}
+    pairs = [p for p in pairs if p[0] in z and p[1] in z] if args.compact else None
+
+t2_per_soap = soap_params(species = species, rcut = r_cut, nmax = nmax, lmax = lmax, periodic= True, sparse = args.sparse, dtype = args.dtype,
+                          sites = "unique" if args.unique_sites else "all", pairs = pairs)
+if args.species == "auto" or args.compact:
+    n_full = len(feature_labels(species, nmax, lmax))
+    n_kept = len(pair_indices(species, nmax, lmax, pairs)) if pairs is not None else n_full
+    print(f"Species {','.join(t2_per_soap['species'])}: {len(pairs or all_pairs(species))} of {len(all_pairs(species))} "
+          f"pair blocks kept, {n_kept} of {n_full} features")
+
+# Reuse a saved projection fitted with the same settings, otherwise fit one
+# on the sample of mean vectors and save it
+def fitted_projection(sample):
+    if args.projection_file and os.path.exists(args.projection_file):
+        proj = Projection.load(args.projection_file)
+        if (proj.method, proj.n_components, proj.params) == (args.project, args.components, t2_per_soap):
+            return proj
+    proj = Projection(args.project, args.components, params = t2_per_soap).fit(sample)
+    if args.projection_file:
+        proj.save(args.projection_file)
+    return proj
+
+
+def report_projection(proj, sample):
+    sample = stack_means(sample)
+    worst, mean = proj.kernel_error(sample)
+    print(f"Projected to {proj.matrix.shape[1]} of {proj.matrix.shape[0]} features ({proj.method}), "
+          f"kernel error on {sample.shape[0]} sample structures: max {worst:.3e}, mean {mean:.3e}")
 
 #---------------------------------------------------------------------
 #RUN SOAP ACROSS n FILES IN LIST AND OUTPUT COMPARISON KERNEL
 #---------------------------------------------------------------------
 tic_1 = time.perf_counter()
-comparisons = [t2_per_soap.create(i) for i in structures]
 
 metric = "linear"
 
-re = AverageKernel(metric = metric)
-kern = re.create(comparisons)
+if args.stream:
+    memory_limit = None if args.memory_limit is None else int(args.memory_limit * 1024**2)
+    names = []
+    means = []
+    # Walking, parsing and SOAP overlap in stream mode, so they are one stage
+    with tracer.stage("stream", workers = args.workers) as stage:
+        timings = []
+        stream = stream_means(walk_cifs(inputdir, e), t2_per_soap, workers = args.workers,
+                              prefetch = args.prefetch, memory_limit = memory_limit, timings = timings)
+        if args.project:
+            # Fit on the first structures, then project the rest batch by batch
+            sample = list(itertools.islice(stream, args.project_sample))
+            proj = fitted_projection([m for name, m in sample])
+            report_projection(proj, [m for name, m in sample])
+            stream = itertools.chain(sample, stream)
+
+        def named(pairs):
+            for name, mean in pairs:
+                names.append(name)
+                yield mean
+        means = list(proj.transform_stream(named(stream))) if args.project else list(named(stream))
+        stage['atoms'] = sum(t['atoms'] for t in timings)
+        stage['bytes'] = sum(t['bytes'] for t in timings)
+    for name, t in zip(names, timings):
+        tracer.record(name, t.pop('start'), t.pop('wall'), pid = t.pop('pid'), **t)
+    ns = len(names)
+    with tracer.stage("kernel", structures = ns):
+        kern = average_kernel(means, block = args.block_size, out = args.kernel_file, upper = args.upper, dtype = args.dtype)
+elif args.incremental:
+    with tracer.stage("incremental") as stage:
+        kern, counts = update_kernel(args.incremental, files, names, t2_per_soap, workers = args.workers, chunksize = args.chunksize)
+        stage.update(counts)
+else:
+    weights = None
+    if args.unique_sites:
+        weights = [site_weights(s, f, t2_per_soap) for s, f in zip(structures, files)]
+
+    timings = []
+    done = ()
+    on_block = None
+    kernel_file = args.kernel_file
+    if args.checkpoint:
+        # Mean vectors are saved chunk by chunk and kernel row blocks as they
+        # complete, so a resumed run only redoes the unfinished chunk or block
+        ckpt = Checkpoint(args.checkpoint, {'files': [os.path.abspath(f) for f in files], 'params': t2_per_soap,
+                                            'chunk': args.checkpoint_every, 'block': args.block_size, 'upper': args.upper,
+                                            'project': [args.project, args.components, args.project_sample]},
+                          resume = args.resume)
+        comparisons = None
+        chunks = []
+        with tracer.stage("soap", workers = args.workers) as stage:
+            for c0 in range(0, ns, args.checkpoint_every):
+                c1 = min(c0 + args.checkpoint_every, ns)
+                chunk = ckpt.load(f"means_{c0}")
+                if chunk is None:
+                    descs, wall, serial = create_descriptors(structures[c0:c1], files[c0:c1], t2_per_soap, workers = args.workers,
+                                                             chunksize = args.chunksize, timings = timings)
+                    chunk = {'means': average_vectors(descs, args.dtype, None if weights is None else weights[c0:c1]),
+                             'wall': wall, 'serial': serial}
+                    ckpt.save(f"means_{c0}", chunk)
+                chunks.append(chunk)
+            means = concat_means([c['means'] for c in chunks], args.dtype)
+            soap_time = sum(c['wall'] for c in chunks)
+            serial_time = sum(c['serial'] for c in chunks)
+        kernel_file = args.kernel_file or ckpt.file("kernel.npy")
+        done = set(ckpt.load("kernel_blocks", []))
+
+        def on_block(i0):
+            done.add(i0)
+            ckpt.save("kernel_blocks", sorted(done))
+        print(f"Checkpoint {args.checkpoint}: {len(done)} kernel row blocks already done")
+    else:
+        with tracer.stage("soap", workers = args.workers) as stage:
+            comparisons, soap_time, serial_time = create_descriptors(structures, files, t2_per_soap, workers = args.workers,
+                                                                     chunksize = args.chunksize, timings = timings)
+            stage['atoms'] = sum(t['atoms'] for t in timings)
+            stage['bytes'] = sum(t['bytes'] for t in timings)
+    for name, t in zip(names, timings):
+        tracer.record(name, t.pop('start'), t.pop('wall'), pid = t.pop('pid'), **t)
+
+    with tracer.stage("kernel", structures = ns):
+        if args.checkpoint or args.project or args.tiled or args.sparse or args.unique_sites or args.upper or args.kernel_file or args.dtype != "float64":
+            if comparisons is not None:
+                means = average_vectors(comparisons, args.dtype, weights)
+            if args.project:
+                proj = fitted_projection(means[:args.project_sample])
+                report_projection(proj, means[:args.project_sample])
+                means = proj.transform(means)
+            kern = average_kernel(means, block = args.block_size, out = kernel_file, upper = args.upper, dtype = args.dtype,
+                                  done = done, on_block = on_block)
+        else:
+            from dscribe.kernels import AverageKernel
+            re = AverageKernel(metric = metric)
+            kern = re.create(comparisons)
 
 toc_1 = time.perf_counter()
 
 comp_time = toc_1 - tic_1
 
 print(f"Took {comp_time:.2} seconds to compare {ns} structures with r_cut = {r_cut:.2}, lmax = {lmax}, nmax = {nmax}")
+if args.incremental:
+    print(f"Computed {counts['new']} new or changed structures, reused {counts['reused']}, dropped {counts['dropped']}")
+elif not args.stream:
+    print(f"Descriptors took {soap_time:.2} seconds on {args.workers} workers ({serial_time / soap_time:.1f}x speedup over {serial_time:.2} seconds serial)")
+    if args.unique_sites:
+        print(f"Described {sum(len(w) for w in weights)} symmetry-unique sites out of {sum(len(s) for s in structures)} atoms")
+    if args.sparse and comparisons is not None:
+        held = sum(descriptor_bytes(c) for c in comparisons)
+        dense = sum(c.shape[0] * c.shape[1] * c.dtype.itemsize for c in comparisons)
+        print(f"Sparse descriptors hold {held / 1024**2:.1f} MB against {dense / 1024**2:.1f} MB dense ({1 - held / dense:.0%} saved)")
+
+# Reference float64 kernel over the first N structures, to judge whether the
+# reduced precision (or sparse) path is accurate enough for this workload
+if args.check_accuracy:
+    k = min(args.check_accuracy, ns)
+    ref_files = list(walk_cifs(inputdir, k)) if args.stream else files[:k]
+    ref_params = soap_params(species = species, rcut = r_cut, nmax = nmax, lmax = lmax, periodic = True, sparse = False)
+    from ase.io import read
+    ref_desc = create_descriptors([read(f) for f in ref_files], ref_files, ref_params, workers = args.workers, chunksize = args.chunksize)[0]
+    ref = average_kernel(average_vectors(ref_desc), block = args.block_size)
+    print(f"Largest deviation from the float64 kernel over {k} structures: {max_deviation(kern[:k, :k], ref, upper = args.upper):.3e}")
+
+#---------------------------------------------------------------------
+#OUTPUT COMPARISON (CSV BY DEFAULT)
+#---------------------------------------------------------------------
+with tracer.stage("write", format = args.format):
+    save_kernel(kern, names, outputdir+"/soap_comparison_rcut = %s" %r_cut, fmt = args.format)
 
 #---------------------------------------------------------------------
-#OUTPUT COMPARISON AS CSV FILE
+#REMATCH CASCADE ON THE AVERAGE KERNEL'S CANDIDATE PAIRS
 #---------------------------------------------------------------------
-soap_array = pd.DataFrame(kern, index = names, columns = names)
-soap_array.to_csv(outputdir+"/soap_comparison_rcut = %s.csv" %r_cut, index = True, header = True, sep = ',')
+if cascading:
+    with tracer.stage("cascade") as stage:
+        if args.cascade_index:
+            vectors = average_vectors(comparisons, weights = weights)
+            index = SimilarityIndex(names, vectors.toarray() if sp.issparse(vectors) else vectors, mode = args.cascade_index)
+            pairs = index_pairs(index, args.cascade_top_k)
+        else:
+            pairs = candidate_pairs(kern, args.cascade_top_k, args.cascade_threshold, block = args.block_size)
+        remkern, stats = cascade(comparisons, pairs, weights = weights)
+        stage.update(evaluated = stats['evaluated'], avoided = stats['avoided'])
+    save_sparse_kernel(remkern, names, outputdir+"/soap_rematch_cascade_rcut = %s" %r_cut, stats = stats)
+    print(f"REMatch on {stats['evaluated']} of {stats['pairs']} pairs ({stats['avoided_fraction']:.1%} avoided) took "
+          f"{stats['rematch_seconds']:.2} seconds, about {stats['full_rematch_seconds_estimate']:.2} seconds for all pairs")
 
+if args.trace:
+    tracer.write()
+    for st in tracer.stages():
+        print(f"{st['name']:12s} {st['wall']:8.3f} s wall {st['cpu']:8.3f} s CPU  max RSS so far {st['max_rss_so_far'] / 1024**2:8.1f} MB")
+    slowest = sorted((ev for ev in tracer.events if ev['kind'] == 'structure'), key = lambda ev: ev['cpu'], reverse = True)[:5]
+    for ev in slowest:
+        print(f"{ev['name']:30s} {ev['cpu']:8.3f} s CPU  {ev['atoms']:6d} atoms  {ev['bytes'] / 1024**2:8.1f} MB")
@@ -0,0 +1,160 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import resource
+import tracemalloc
+from importlib.metadata import version
+import numpy as np
+from soap_cache import soap_params, get_soap, to_csr, descriptor_bytes
+from soap_sweep import sweep_points
+from soap_neighbours import ExtendedEnvironment, environment_radius
+from soap_kernels import average_vectors, average_kernel
+from soap_rematch import rematch_kernel
+
+#---------------------------------------------------------------------
+#SYSTEM PARAMETERS
+#---------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(description = "Benchmark SOAP creation, AVERAGE and REMatch kernels over a parameter grid")
+commands = parser.add_subparsers(dest = "command", required = True)
+
+run = commands.add_parser("run", help = "time every benchmark at every grid point")
+run.add_argument("files", nargs = "+", help = "CIF files the benchmarks are run on")
+run.add_argument("--out", required = True, help = "JSON results file")
+run.add_argument("--nmax", default = "4,8", help = "comma separated nmax values")
+run.add_argument("--lmax", default = "4,9", help = "comma separated lmax values")
+run.add_argument("--rcut", default = "10,20", help = "comma separated rcut values")
+run.add_argument("--species", default = "C,H,O,N", help = "comma separated species list")
+run.add_argument("--warmup", type = int, default = 2, help = "untimed runs before measuring")
+run.add_argument("--repeats", type = int, default = 7, help = "timed runs per measurement")
+
+compare = commands.add_parser("compare", help = "flag regressions between two results files")
+compare.add_argument("base", help = "reference results")
+compare.add_argument("new", help = "results to check")
+compare.add_argument("--threshold", type = float, default = 0.10, help = "relative median slowdown counted as a regression")
+
+args = parser.parse_args()
+
+#---------------------------------------------------------------------
+#MEASUREMENT
+#---------------------------------------------------------------------
+
+#Median/IQR timing after warm-up runs, then one extra run under tracemalloc
+#for the peak of Python/numpy allocations (kept out of the timed runs)
+def measure(func, warmup, repeats):
+    for i in range(warmup):
+        func()
+    times = []
+    for i in range(repeats):
+        tic = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - tic)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'median': median, 'q1': q1, 'q3': q3, 'iqr': q3 - q1, 'min': min(times),
+            'mean': float(np.mean(times)), 'repeats': repeats, 'peak_bytes': peak}
+
+
+def result_key(r):
+    return r['benchmark'] + ' ' + json.dumps(r['point'], sort_keys = True)
+
+#---------------------------------------------------------------------
+#RUN BENCHMARKS OVER THE GRID
+#---------------------------------------------------------------------
+if args.command == "run":
+    for f in args.files:
+        if not os.path.isfile(f):
+            print(f"{f} is not a file!")
+            sys.exit()
+    from ase.io import read
+    from dscribe.kernels import AverageKernel, REMatchKernel
+    from sklearn.preprocessing import normalize
+    structures = [read(f) for f in args.files]
+    species = args.species.split(",")
+
+    spec = {'axes': {'rcut': [float(v) for v in args.rcut.split(",")],
+                     'nmax': [int(v) for v in args.nmax.split(",")],
+                     'lmax': [int(v) for v in args.lmax.split(",")]}}
+
+    results = []
+    for point in sweep_points(spec):
+        params = soap_params(species = species, rcut = point['rcut'], nmax = point['nmax'], lmax = point['lmax'],
+                             rbf = point['rbf'], periodic = True, sparse = False)
+        soap = get_soap(params)
+        environments = [ExtendedEnvironment(s, environment_radius(params, point['rcut'])) for s in structures]
+        sparse_soap = get_soap(dict(params, sparse = True))
+        descriptors = [soap.create(s) for s in structures]
+        sparse_descriptors = [to_csr(sparse_soap.create(s)) for s in structures]
+        normed = [normalize(d) for d in descriptors]
+        single = [d.astype(np.float32) for d in descriptors]
+        held = {'dense': sum(descriptor_bytes(d) for d in descriptors),
+                'sparse': sum(descriptor_bytes(d) for d in sparse_descriptors)}
+
+        benchmarks = {
+            'soap': lambda: [soap.create(s) for s in structures],
+            'average': lambda: AverageKernel(metric = 'linear').create(descriptors),
+            'average_tiled': lambda: average_kernel(average_vectors(descriptors)),
+            'soap_extended': lambda: [e.create(params) for e in environments],
+            'soap_sparse': lambda: [to_csr(sparse_soap.create(s)) for s in structures],
+            'average_sparse': lambda: average_kernel(average_vectors(sparse_descriptors)),
+            'average_float32': lambda: average_kernel(average_vectors(single, np.float32), dtype = np.float32),
+            'rematch': lambda: REMatchKernel(metric = 'rbf', gamma = 1, alpha = 1, threshold = 1e-6).create(normed),
+            'rematch_batched': lambda: rematch_kernel(descriptors, alpha = 1, gamma = 1, threshold = 1e-6),
+        }
+        for name, func in benchmarks.items():
+            r = {'benchmark': name, 'point': point, 'features': len(descriptors[0][0]),
+                 'descriptor_bytes': held['sparse' if name.endswith('_sparse') else 'dense']}
+            r.update(measure(func, args.warmup, args.repeats))
+            results.append(r)
+            print(f"{name:16s} rcut = {point['rcut']:5.1f} nmax = {point['nmax']:2d} lmax = {point['lmax']:2d}  "
+                  f"median {r['median']*1e3:9.3f} ms  IQR {r['iqr']*1e3:8.3f} ms  peak {r['peak_bytes']/2**20:8.2f} MB")
+
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'machine': {'node': platform.node(), 'platform': platform.platform(), 'processor': platform.processor(),
+                          'cpus': os.cpu_count(), 'python': platform.python_version(),
+                          'numpy': np.__version__, 'dscribe': version('dscribe')},
+              'files': [os.path.abspath(f) for f in args.files],
+              'warmup': args.warmup, 'repeats': args.repeats,
+              'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent = 1)
+
+#---------------------------------------------------------------------
+#COMPARE TWO RESULTS FILES
+#---------------------------------------------------------------------
+else:
+    with open(args.base) as f:
+        base = {result_key(r): r for r in json.load(f)['results']}
+    with open(args.new) as f:
+        new = {result_key(r): r for r in json.load(f)['results']}
+
+    #A regression must be slower by more than the threshold and lie clear of
+    #the reference interquartile range, so run-to-run noise is not flagged
+    regressions = 0
+    for key in sorted(set(base) & set(new)):
+        b = base[key]
+        n = new[key]
+        change = n['median'] / b['median'] - 1
+        flag = change > args.threshold and n['q1'] > b['q3']
+        regressions += flag
+        print(f"{'REGRESSION' if flag else 'ok':10s} {key}  {b['median']*1e3:9.3f} -> {n['median']*1e3:9.3f} ms ({change:+.1%})")
+
+    missing = sorted(set(base) ^ set(new))
+    for key in missing:
+        print(f"{'unmatched':10s} {key}")
+
+    print(f"{regressions} regressions in {len(set(base) & set(new))} benchmarks")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,254 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import json
+import time
+import hashlib
+from importlib.metadata import version
+import numpy as np
+import scipy.sparse as sp
+from ase.data import atomic_numbers
+from soap_symmetry import unique_sites
+from soap_slicer import pair_indices
+from soap_species import all_pairs
+
+#---------------------------------------------------------------------
+#CACHE SETTINGS
+#---------------------------------------------------------------------
+
+# Descriptor store shared by every script. Location and size can be
+# overridden from the environment, SOAP_CACHE=0 switches caching off.
+CACHE_DIR = os.environ.get('SOAP_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'dscribe_tools', 'soap'))
+CACHE_MAX_BYTES = int(float(os.environ.get('SOAP_CACHE_MAX_GB', '20')) * 1024**3)
+CACHE_ENABLED = os.environ.get('SOAP_CACHE', '1') != '0'
+
+#---------------------------------------------------------------------
+#SOAP PARAMETERS AND GENERATORS
+#---------------------------------------------------------------------
+
+#Canonical parameter dictionary - species are ordered by atomic number
+#so that a list and a set of the same species give the same key. dtype and
+#sites are only recorded when they are not the defaults (float64, every
+#atom, all pairs), so existing cache keys stay valid. sites = 'unique'
+#describes one representative atom per symmetry orbit (see
+#soap_symmetry.py). pairs lists the (Z1, Z2) species-pair blocks to keep;
+#the others are cut out of every descriptor (see soap_species.py)
+def soap_params(species, rcut, nmax, lmax, rbf = 'gto', periodic = True, sparse = False, dtype = 'float64', sites = 'all',
+                pairs = None):
+    species = sorted(set(species), key = lambda s: atomic_numbers[s])
+    params = {'species': species, 'rcut': float(rcut), 'nmax': int(nmax), 'lmax': int(lmax),
+              'rbf': rbf, 'periodic': bool(periodic), 'sparse': bool(sparse)}
+    if np.dtype(dtype) != np.float64:
+        params['dtype'] = np.dtype(dtype).name
+    if sites == 'unique':
+        params['sites'] = 'unique'
+    if pairs is not None:
+        pairs = sorted([int(a), int(b)] for a, b in pairs)
+        if pairs != sorted(list(p) for p in all_pairs(species)):
+            params['pairs'] = pairs
+    return params
+
+
+def params_dtype(params):
+    return np.dtype(params.get('dtype', 'float64'))
+
+
+def params_id(params):
+    return json.dumps(params, sort_keys = True)
+
+
+_generators = {}
+
+#Build each SOAP generator once per parameter set
+def get_soap(params):
+    pid = params_id(params)
+    if pid not in _generators:
+        #dscribe is imported on first use, so runs served from the cache skip it
+        from dscribe.descriptors import SOAP
+        _generators[pid] = SOAP(species = params['species'], rcut = params['rcut'], nmax = params['nmax'],
+                                lmax = params['lmax'], rbf = params['rbf'], periodic = params['periodic'],
+                                sparse = params['sparse'], dtype = params_dtype(params).name)
+    return _generators[pid]
+
+#---------------------------------------------------------------------
+#SPARSE DESCRIPTORS
+#---------------------------------------------------------------------
+
+# With sparse = True dscribe returns a pydata sparse.COO array. It is turned
+# into a scipy CSR matrix straight away, which slices by row, averages and
+# multiplies without ever building the dense (atoms x features) array.
+
+def to_csr(desc):
+    return desc.to_scipy_sparse().tocsr()
+
+
+#Bytes actually held by a dense or CSR descriptor
+def descriptor_bytes(desc):
+    if sp.issparse(desc):
+        return desc.data.nbytes + desc.indices.nbytes + desc.indptr.nbytes
+    return np.asarray(desc).nbytes
+
+#---------------------------------------------------------------------
+#CONTENT HASHING
+#---------------------------------------------------------------------
+
+_digests = {}
+
+#SHA-256 of the structure file, remembered while size and mtime are unchanged
+def file_digest(path):
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if stamp not in _digests:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _digests[stamp] = h.hexdigest()
+    return _digests[stamp]
+
+#---------------------------------------------------------------------
+#ON-DISK DESCRIPTOR STORE
+#---------------------------------------------------------------------
+
+class DescriptorCache:
+
+    def __init__(self, root = CACHE_DIR, max_bytes = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None
+        #Read from the package metadata, so dscribe itself is not imported
+        self.dscribe_version = version('dscribe')
+        os.makedirs(root, exist_ok = True)
+
+    #A dscribe upgrade can change the descriptors, so its version is part of
+    #the key and old entries simply stop matching
+    def key(self, digest, params):
+        return hashlib.sha256((digest + params_id(params) + self.dscribe_version).encode()).hexdigest()
+
+    #Dense descriptors are stored as .npy, sparse ones as scipy .npz
+    def _paths(self, key, sparse = False):
+        base = os.path.join(self.root, key[:2], key)
+        return base + ('.npz' if sparse else '.npy'), base + '.json'
+
+    #Return (descriptor, metadata) or None. Dense arrays come back
+    #memory-mapped, sparse ones as CSR matrices. A hit refreshes the entry's
+    #mtime, which drives LRU eviction
+    def get(self, key):
+        meta = self._paths(key)[1]
+        try:
+            with open(meta) as f:
+                info = json.load(f)
+            blob = self._paths(key, info.get('sparse', False))[0]
+            if info.get('sparse', False):
+                desc = sp.load_npz(blob).tocsr()
+            else:
+                desc = np.load(blob, mmap_mode = 'r')
+            os.utime(blob)
+        except (OSError, ValueError):
+            return None
+        return desc, info
+
+    def put(self, key, desc, info):
+        sparse = sp.issparse(desc)
+        blob, meta = self._paths(key, sparse)
+        info = dict(info, sparse = sparse)
+        os.makedirs(os.path.dirname(blob), exist_ok = True)
+        tmp = f'{blob}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            if sparse:
+                sp.save_npz(f, desc, compressed = False)
+            else:
+                np.save(f, np.ascontiguousarray(desc))
+        os.replace(tmp, blob)
+        tmp = f'{meta}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp, meta)
+
+        if self._size is not None:
+            self._size += os.path.getsize(blob)
+        if self.size() > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if e.name.endswith(('.npy', '.npz')):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(e[1] for e in self._entries())
+        return self._size
+
+    #Drop least recently used blobs until the store fits in max_bytes
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        for mtime, size, blob in entries:
+            if total <= self.max_bytes:
+                break
+            for path in (blob, blob[:-4] + '.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+        self._size = total
+
+
+_default_cache = []
+
+def default_cache():
+    if not CACHE_ENABLED:
+        return None
+    if not _default_cache:
+        _default_cache.append(DescriptorCache())
+    return _default_cache[0]
+
+#---------------------------------------------------------------------
+#CACHED DESCRIPTOR CREATION
+#---------------------------------------------------------------------
+
+#Return the descriptor for the structure read from path together with the
+#time SOAP took to compute it (recorded at first computation on a cache hit).
+#A soap_neighbours.ExtendedEnvironment of the structure, if given, supplies
+#the periodic images instead of dscribe's own extension. cache is True for
+#the shared store, a DescriptorCache, or None to compute without caching
+def create_soap_timed(structure, path, params, cache = True, environment = None):
+    if cache is True:
+        cache = default_cache()
+    if cache is not None:
+        key = cache.key(file_digest(path), params)
+        hit = cache.get(key)
+        if hit is not None:
+            return hit[0], hit[1]['seconds']
+
+    tic = time.perf_counter()
+    if environment is not None:
+        desc = environment.create(params, unique_sites(structure, path)[0] if params.get('sites') == 'unique' else None)
+    elif params.get('sites') == 'unique':
+        desc = get_soap(params).create(structure, positions = unique_sites(structure, path)[0].tolist())
+    else:
+        desc = get_soap(params).create(structure)
+    if params['sparse']:
+        desc = to_csr(desc)
+    if 'pairs' in params:
+        desc = desc[:, pair_indices(params['species'], params['nmax'], params['lmax'], params['pairs'])]
+    toc = time.perf_counter()
+
+    if cache is not None:
+        cache.put(key, desc, {'source': os.path.abspath(path), 'params': params,
+                              'shape': list(desc.shape), 'seconds': toc - tic})
+    return desc, toc - tic
+
+
+def create_soap(structure, path, params, cache = True):
+    return create_soap_timed(structure, path, params, cache)[0]
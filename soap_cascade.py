@@ -0,0 +1,69 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import time
+import numpy as np
+import scipy.sparse as sp
+from soap_rematch import rematch_selected
+
+#---------------------------------------------------------------------
+#TWO-STAGE SCREENING CASCADE
+#---------------------------------------------------------------------
+
+# The AVERAGE kernel (or a top-k search over the averaged-vector index) is
+# cheap enough for every pair; REMatch is far slower but more
+# discriminating. The cascade keeps the pairs the AVERAGE kernel ranks as
+# candidates - each structure's top_k neighbours and/or every pair at or
+# above threshold - and runs REMatch only on those. The result is a sparse
+# symmetric matrix of REMatch values (diagonal 1) holding just the candidate
+# pairs, plus counts of the REMatch evaluations that were avoided.
+
+#Candidate pairs (i < j) from a full AVERAGE kernel matrix, processed in row
+#blocks so memory-mapped kernels are not loaded whole
+def candidate_pairs(kern, top_k = None, threshold = None, block = 512):
+    n = kern.shape[0]
+    found = set()
+    for i0 in range(0, n, block):
+        rows = np.array(kern[i0:i0 + block], dtype = np.float64)
+        rows[np.arange(len(rows)), np.arange(i0, i0 + len(rows))] = -np.inf
+        if top_k:
+            k = min(top_k, n - 1)
+            best = np.argpartition(-rows, k - 1, axis = 1)[:, :k]
+            found.update((min(i0 + r, j), max(i0 + r, j)) for r, js in enumerate(best.tolist()) for j in js)
+        if threshold is not None:
+            r, j = np.nonzero(rows >= threshold)
+            found.update((min(a, b), max(a, b)) for a, b in zip((r + i0).tolist(), j.tolist()))
+    return sorted(found)
+
+
+#Candidate pairs from a soap_index.SimilarityIndex over the same structures,
+#in its own order: each structure's top_k hits, without the N x N kernel
+def index_pairs(index, top_k):
+    found = set()
+    for i, v in enumerate(index.vectors):
+        idx, sc = index.search(v, top_k + 1)
+        found.update((min(i, j), max(i, j)) for j in idx.tolist() if j != i)
+    return sorted(found)
+
+
+#REMatch on the candidate pairs. Returns the sparse CSR matrix and the stats.
+#Weights are per-structure site multiplicities for descriptors computed at
+#symmetry-unique sites only, used as the Sinkhorn marginals
+def cascade(descriptors, pairs, alpha = 1, gamma = 1, threshold = 1e-6, batch = 256, weights = None):
+    n = len(descriptors)
+    dense = [d.toarray() if sp.issparse(d) else d for d in descriptors]
+    tic = time.perf_counter()
+    values = rematch_selected(dense, pairs, alpha = alpha, gamma = gamma, threshold = threshold, batch = batch, weights = weights)
+    seconds = time.perf_counter() - tic
+
+    i, j = (np.array(a, dtype = int) for a in zip(*pairs)) if pairs else (np.empty(0, int), np.empty(0, int))
+    diag = np.arange(n)
+    result = sp.csr_matrix((np.concatenate([values, values, np.ones(n)]),
+                            (np.concatenate([i, j, diag]), np.concatenate([j, i, diag]))), shape = (n, n))
+
+    total = n * (n - 1) // 2
+    stats = {'structures': n, 'pairs': total, 'evaluated': len(pairs), 'avoided': total - len(pairs),
+             'avoided_fraction': (total - len(pairs)) / total if total else 0.0, 'rematch_seconds': seconds,
+             'full_rematch_seconds_estimate': seconds / len(pairs) * total if pairs else 0.0}
+    return result, stats
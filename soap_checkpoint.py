@@ -0,0 +1,80 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import json
+import pickle
+import re
+import hashlib
+
+#---------------------------------------------------------------------
+#ATOMIC WRITES
+#---------------------------------------------------------------------
+
+#Write through a temporary file in the same directory and rename it into
+#place, so a crash leaves either the old file or the complete new one
+def atomic_write(path, data, mode = 'wb'):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+#---------------------------------------------------------------------
+#CHECKPOINT DIRECTORY
+#---------------------------------------------------------------------
+
+# A checkpoint is a directory with meta.json describing the run (input files,
+# SOAP parameters, chunking) and one pickle per completed unit of work - a
+# chunk of mean vectors, a sweep point, the list of finished kernel row
+# blocks. Without resume the files an earlier checkpoint wrote are removed
+# when the run starts; with resume the stored meta must match the run
+# exactly, so results of a different run are never mixed in. Only
+# checkpoint files are ever deleted: a non-empty directory without meta.json
+# is refused, and the directory itself is kept.
+
+CHECKPOINT_FILE = re.compile(r'^[0-9a-f]{32}\.pkl$')
+OWNED_FILES = ['meta.json', 'kernel.npy']
+
+
+class Checkpoint:
+
+    def __init__(self, path, meta, resume = False):
+        self.path = path
+        self.meta = json.loads(json.dumps(meta))
+        meta_file = os.path.join(path, 'meta.json')
+        if resume and os.path.exists(meta_file):
+            with open(meta_file) as f:
+                stored = json.load(f)
+            if stored != self.meta:
+                raise ValueError(f"Checkpoint {path} belongs to a different run, remove it or drop --resume")
+            return
+        os.makedirs(path, exist_ok = True)
+        if os.listdir(path) and not os.path.exists(meta_file):
+            raise ValueError(f"Checkpoint directory {path} is not empty and holds no checkpoint, choose an empty or new directory")
+        self.clear()
+        atomic_write(meta_file, json.dumps(self.meta), mode = 'w')
+
+    #Remove the files a checkpoint writes, leaving anything else in place
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name in OWNED_FILES or CHECKPOINT_FILE.match(name):
+                os.remove(os.path.join(self.path, name))
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest()[:32] + '.pkl')
+
+    def load(self, key, default = None):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return default
+
+    def save(self, key, value):
+        atomic_write(self._file(key), pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL))
+
+    def file(self, name):
+        return os.path.join(self.path, name)
@@ -0,0 +1,143 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import numpy as np
+from soap_cache import soap_params, create_soap_timed
+from soap_kernels import average_vector
+from soap_slicer import padded_pair
+
+#---------------------------------------------------------------------
+#ADAPTIVE CONVERGENCE SEARCH
+#---------------------------------------------------------------------
+
+# Along one axis (rcut, nmax or lmax, the others fixed) the match between the
+# descriptors at successive grid values rises towards 1 as SOAP converges.
+# Instead of evaluating every grid value, bisection over the grid finds the
+# first value whose match with its predecessor is within tol of 1: probing
+# value i needs SOAP at i - 1 and i only. The match is assumed to settle
+# monotonically, so the result is the one the full sweep would give. The
+# value after the converged one is also checked ('confirmed'); if it falls
+# back above tol, the search continues on the rest of the grid.
+#
+# Neighbouring lmax descriptors are compared in the larger layout with the
+# smaller one zero-padded. Comparing only shared features would make every
+# lmax step match exactly, since a lower-lmax spectrum is a subset of the
+# higher one. As a guard, a step whose added channels carry no weight at all
+# is reported as 'trivial' rather than as convergence.
+#
+# Along nmax the features cannot be compared at all: dscribe rebuilds the
+# orthonormal radial basis for every nmax, so the same (l, n1, n2) label
+# holds a different quantity at each value. What does converge is the
+# similarity between the structure's atomic environments (the dot product of
+# power spectra approaches the basis-free density overlap), so an nmax step
+# is matched by the cosine between the two normalised environment Gram
+# matrices. A single-atom structure has nothing to compare and matches 1.
+
+#Cosine between the Gram matrices of two descriptors' normalised local
+#environments, which does not depend on the radial basis
+def environment_match(first, second):
+    first = np.asarray(first) / np.linalg.norm(first, axis = 1)[:, None]
+    second = np.asarray(second) / np.linalg.norm(second, axis = 1)[:, None]
+    g1 = first @ first.T
+    g2 = second @ second.T
+    return float(np.sum(g1 * g2) / np.sqrt(np.sum(g1 * g1) * np.sum(g2 * g2)))
+
+
+#Match between the descriptors at two neighbouring grid points, and the
+#share of the added channels (NaN along nmax). For rcut and lmax steps this
+#is the normalised linear AVERAGE kernel in the common layout, the share
+#being that of the larger mean vector's squared norm sitting in the channels
+#the smaller layout lacks; nmax steps use environment_match
+def successive_match(first, second, species, a, b):
+    if a['nmax'] != b['nmax']:
+        return environment_match(first, second), np.nan
+    first, second = padded_pair(first, second, species, a['nmax'], a['lmax'], b['nmax'], b['lmax'])
+    m1 = average_vector(first)
+    m2 = average_vector(second)
+    missing = (m1 == 0) & (m2 != 0) if b['lmax'] >= a['lmax'] else (m2 == 0) & (m1 != 0)
+    larger = m2 if b['lmax'] >= a['lmax'] else m1
+    added = float(larger[missing] @ larger[missing] / (larger @ larger))
+    return float(m1 @ m2 / np.sqrt((m1 @ m1) * (m2 @ m2))), added
+
+
+class ConvergenceSearch:
+
+    def __init__(self, structure, path, axis, values, fixed, species, tol = 1e-3, rbf = 'gto', periodic = True):
+        self.structure = structure
+        self.path = path
+        self.axis = axis
+        self.values = list(values)
+        self.fixed = dict(fixed)
+        self.species = species
+        self.tol = tol
+        self.rbf = rbf
+        self.periodic = periodic
+        self._descriptors = {}
+        self.matches = {}
+        self.added = {}
+        self.soap_time = 0.0
+
+    def point(self, i):
+        point = dict(self.fixed)
+        point[self.axis] = self.values[i]
+        return point
+
+    def descriptor(self, i):
+        if i not in self._descriptors:
+            p = self.point(i)
+            params = soap_params(species = self.species, rcut = p['rcut'], nmax = p['nmax'], lmax = p['lmax'],
+                                 rbf = self.rbf, periodic = self.periodic, sparse = False)
+            desc, seconds = create_soap_timed(self.structure, self.path, params)
+            self._descriptors[i] = np.asarray(desc)
+            self.soap_time += seconds
+        return self._descriptors[i]
+
+    #Match between grid values i - 1 and i
+    def match(self, i):
+        if i not in self.matches:
+            self.matches[i], self.added[i] = successive_match(self.descriptor(i - 1), self.descriptor(i), self.species,
+                                                              self.point(i - 1), self.point(i))
+        return self.matches[i]
+
+    #An lmax step only counts when the added channels hold some weight
+    def trivial(self, i):
+        return self.point(i - 1)['lmax'] != self.point(i)['lmax'] and self.added.get(i, 1.0) == 0.0
+
+    def converged(self, i):
+        return 1 - self.match(i) < self.tol
+
+    #First grid index i >= lo whose match with i - 1 is within tol, by
+    #bisection, or None when the last value is not converged either
+    def _bisect(self, lo):
+        hi = len(self.values) - 1
+        if lo > hi or not self.converged(hi):
+            return None
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.converged(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def run(self):
+        found = self._bisect(1)
+        while found is not None and found + 1 < len(self.values) and not self.converged(found + 1):
+            found = self._bisect(found + 2)
+        return {'axis': self.axis, 'tol': self.tol,
+                'value': None if found is None else self.values[found],
+                'match': None if found is None else self.matches[found],
+                'confirmed': found is not None and found + 1 in self.matches,
+                'trivial': found is not None and self.trivial(found),
+                'evaluations': len(self._descriptors), 'grid': len(self.values), 'soap_time': self.soap_time}
+
+    #Evaluated points in grid order, with the match against the predecessor
+    def table(self):
+        rows = []
+        for i in sorted(self._descriptors):
+            row = self.point(i)
+            row['match'] = self.matches.get(i, np.nan)
+            row['added'] = self.added.get(i, np.nan)
+            rows.append(row)
+        return rows
@@ -0,0 +1,93 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import json
+import numpy as np
+import scipy.sparse as sp
+from soap_cache import params_id, params_dtype, file_digest
+from soap_parallel import create_descriptors
+from soap_kernels import average_vectors
+from soap_symmetry import site_weights
+
+#---------------------------------------------------------------------
+#SAVED KERNEL STATE
+#---------------------------------------------------------------------
+
+# A state is two files next to each other: STATE.npz with the names, paths,
+# content hashes and mean vectors of every structure plus the SOAP
+# parameters, and STATE.kernel.npy with the full kernel matrix (loaded
+# memory-mapped).
+
+def state_paths(state):
+    return state + '.npz', state + '.kernel.npy'
+
+
+def save_state(state, names, files, digests, means, kern, params):
+    meta, kfile = state_paths(state)
+    np.save(kfile, kern)
+    np.savez(meta, names = np.array(names), paths = np.array([os.path.abspath(f) for f in files]),
+             digests = np.array(digests), means = means, params = json.dumps(params))
+
+
+def load_state(state):
+    meta, kfile = state_paths(state)
+    with np.load(meta) as data:
+        loaded = {'names': [str(s) for s in data['names']], 'digests': [str(s) for s in data['digests']],
+                  'means': data['means'], 'params': json.loads(str(data['params']))}
+    loaded['kernel'] = np.load(kfile, mmap_mode = 'r')
+    return loaded
+
+#---------------------------------------------------------------------
+#INCREMENTAL KERNEL UPDATE
+#---------------------------------------------------------------------
+
+#Kernel for the given files, reusing the saved state. Structures whose
+#content hash is already in the state keep their mean vector and kernel
+#entries; only new or changed files are parsed and described, and only their
+#rows and columns are computed. The updated state is written back and
+#(kernel, counts) returned, counts holding the new, reused and dropped totals
+def update_kernel(state, files, names, params, workers = 1, chunksize = 1):
+    old = None
+    if os.path.exists(state_paths(state)[0]):
+        old = load_state(state)
+        if params_id(old['params']) != params_id(params):
+            old = None
+
+    digests = [file_digest(f) for f in files]
+    known = {} if old is None else {d: i for i, d in enumerate(old['digests'])}
+    reuse = [known.get(d) for d in digests]
+    fresh = [i for i, r in enumerate(reuse) if r is None]
+    kept = [i for i, r in enumerate(reuse) if r is not None]
+    old_idx = [reuse[i] for i in kept]
+
+    from ase.io import read
+    structures = [read(files[i]) for i in fresh]
+    descriptors, soap_time, serial_time = create_descriptors(structures, [files[i] for i in fresh], params,
+                                                             workers = workers, chunksize = chunksize)
+
+    n = len(files)
+    n_features = old['means'].shape[1] if old is not None else descriptors[0].shape[1]
+    dtype = params_dtype(params)
+    means = np.empty((n, n_features), dtype = dtype)
+    if kept:
+        means[kept] = old['means'][old_idx]
+    if fresh:
+        weights = [site_weights(s, files[i], params) for s, i in zip(structures, fresh)]
+        fresh_means = average_vectors(descriptors, weights = weights)
+        means[fresh] = fresh_means.toarray() if sp.issparse(fresh_means) else fresh_means
+    unit = means / np.sqrt(np.einsum('ij,ij->i', means, means))[:, None]
+
+    kern = np.empty((n, n), dtype = dtype)
+    if kept:
+        kern[np.ix_(kept, kept)] = old['kernel'][np.ix_(old_idx, old_idx)]
+    if fresh:
+        rows = unit[fresh] @ unit.T
+        kern[fresh, :] = rows
+        kern[:, fresh] = rows.T
+
+    save_state(state, names, files, digests, means, kern, params)
+
+    dropped = 0 if old is None else len(old['digests']) - len(set(old_idx))
+    return kern, {'new': len(fresh), 'reused': len(kept), 'dropped': dropped}
@@ -0,0 +1,160 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import json
+import numpy as np
+
+#---------------------------------------------------------------------
+#TOP-K SIMILARITY INDEX OVER AVERAGED SOAP VECTORS
+#---------------------------------------------------------------------
+
+# With unit-length mean vectors the normalised linear AVERAGE kernel is a dot
+# product, so k-nearest-neighbour search over the index gives the k largest
+# AverageKernel values without building the N x N matrix.
+
+MODES = ['exact', 'lsh', 'ivf']
+
+
+def unit_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype = np.float64))
+    return vectors / np.sqrt(np.einsum('ij,ij->i', vectors, vectors))[:, None]
+
+
+#Indices and scores of the k largest entries, best first
+def top_k(scores, k):
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind = 'stable')]
+    return best, scores[best]
+
+
+class SimilarityIndex:
+
+    def __init__(self, names, means, params = None, mode = 'exact', n_bits = 12, n_tables = 8,
+                 n_lists = None, n_probe = 4, block = 4096, seed = 0):
+        self.names = list(names)
+        self.vectors = unit_rows(means)
+        self.params = params
+        self.mode = mode
+        self.block = block
+        self.n_bits = n_bits
+        self.n_tables = n_tables
+        self.n_probe = n_probe
+        self.seed = seed
+        n = len(self.names)
+        self.n_lists = n_lists if n_lists is not None else max(1, int(np.sqrt(n)))
+
+        if mode == 'lsh':
+            self._build_lsh()
+        elif mode == 'ivf':
+            self._build_ivf()
+        elif mode != 'exact':
+            raise ValueError(f"Unknown index mode {mode}, choose from {MODES}")
+
+    #Random-hyperplane LSH: each table hashes a vector to the sign pattern of
+    #n_bits projections, similar vectors (small angle) tend to share buckets.
+    #SOAP vectors crowd into one orthant, so they are centred before hashing
+    def _build_lsh(self):
+        rng = np.random.default_rng(self.seed)
+        dim = self.vectors.shape[1]
+        self.center = self.vectors.mean(axis = 0)
+        self.planes = rng.standard_normal((self.n_tables, dim, self.n_bits))
+        self.weights = 1 << np.arange(self.n_bits)
+        self.tables = []
+        for t in range(self.n_tables):
+            codes = ((self.vectors - self.center) @ self.planes[t] > 0) @ self.weights
+            order = np.argsort(codes, kind = 'stable')
+            keys, starts = np.unique(codes[order], return_index = True)
+            self.tables.append(dict(zip(keys.tolist(), np.split(order, starts[1:]))))
+
+    #IVF: spherical k-means partition of the unit vectors, trained on a sample
+    #of at most 64 points per list. Queries only scan the n_probe lists whose
+    #centroids are closest
+    def _build_ivf(self, iterations = 10):
+        rng = np.random.default_rng(self.seed)
+        n = len(self.vectors)
+        n_lists = min(self.n_lists, n)
+        train = self.vectors[rng.choice(n, size = min(n, 64 * n_lists), replace = False)]
+        centroids = train[rng.choice(len(train), size = n_lists, replace = False)]
+        for it in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis = 1)
+            members = np.zeros((n_lists, len(train)))
+            members[assign, np.arange(len(train))] = 1
+            filled = members.any(axis = 1)
+            centroids[filled] = unit_rows((members @ train)[filled])
+        self.centroids = centroids
+        assign = np.concatenate([np.argmax(self.vectors[i0:i0 + self.block] @ centroids.T, axis = 1)
+                                 for i0 in range(0, n, self.block)])
+        self.lists = [np.flatnonzero(assign == c) for c in range(n_lists)]
+
+    #Exact search scans the vectors in blocks so memory stays bounded
+    def _exact(self, q, k):
+        best_idx = np.empty(0, dtype = int)
+        best_score = np.empty(0)
+        for i0 in range(0, len(self.vectors), self.block):
+            scores = self.vectors[i0:i0 + self.block] @ q
+            idx, sc = top_k(scores, k)
+            best_idx = np.concatenate([best_idx, idx + i0])
+            best_score = np.concatenate([best_score, sc])
+            keep, best_score = top_k(best_score, k)
+            best_idx = best_idx[keep]
+        return best_idx, best_score
+
+    def _candidates(self, q):
+        if self.mode == 'lsh':
+            found = [table.get(int(((q - self.center) @ self.planes[t] > 0) @ self.weights))
+                     for t, table in enumerate(self.tables)]
+            found = [f for f in found if f is not None]
+            return np.unique(np.concatenate(found)) if found else np.empty(0, dtype = int)
+        order = np.argsort(-(self.centroids @ q))[:self.n_probe]
+        return np.concatenate([self.lists[c] for c in order])
+
+    #k most similar indexed structures to a mean vector, as (indices, scores).
+    #Approximate modes re-rank their candidates exactly and fall back to an
+    #exact scan when fewer than k candidates are found
+    def search(self, mean, k = 10, exact = False):
+        q = unit_rows(mean)[0]
+        if exact or self.mode == 'exact':
+            return self._exact(q, k)
+        cand = self._candidates(q)
+        if len(cand) < min(k, len(self.vectors)):
+            return self._exact(q, k)
+        idx, sc = top_k(self.vectors[cand] @ q, k)
+        return cand[idx], sc
+
+    def query(self, mean, k = 10, exact = False):
+        idx, sc = self.search(mean, k, exact)
+        return [(self.names[i], s) for i, s in zip(idx, sc)]
+
+    #Mean fraction of the exact top-k recovered by this index. Each query
+    #costs an exact scan, so with sample only that many randomly chosen
+    #queries are checked
+    def recall(self, means, k = 10, sample = None):
+        means = np.atleast_2d(means)
+        if sample is not None and len(means) > sample:
+            means = means[np.random.default_rng(self.seed).choice(len(means), sample, replace = False)]
+        hits = []
+        for m in means:
+            approx = set(self.search(m, k)[0])
+            exact = set(self.search(m, k, exact = True)[0])
+            hits.append(len(approx & exact) / len(exact))
+        return float(np.mean(hits))
+
+    def save(self, path):
+        settings = {'mode': self.mode, 'n_bits': self.n_bits, 'n_tables': self.n_tables,
+                    'n_lists': self.n_lists, 'n_probe': self.n_probe, 'block': self.block,
+                    'seed': self.seed, 'params': self.params}
+        np.savez(path, names = np.array(self.names), vectors = self.vectors, settings = json.dumps(settings))
+
+    #Approximate structures are rebuilt from the stored vectors and seed,
+    #optionally in a different mode
+    @classmethod
+    def load(cls, path, mode = None):
+        with np.load(path) as data:
+            settings = json.loads(str(data['settings']))
+            names = [str(s) for s in data['names']]
+            vectors = data['vectors']
+        if mode is not None:
+            settings['mode'] = mode
+        return cls(names, vectors, **settings)
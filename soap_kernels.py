@@ -0,0 +1,108 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import numpy as np
+import scipy.sparse as sp
+
+#---------------------------------------------------------------------
+#AVERAGE KERNEL FROM PER-STRUCTURE MEAN VECTORS
+#---------------------------------------------------------------------
+
+#The linear AVERAGE kernel only needs the mean of each structure's local
+#descriptors: K(A,B) = mean_ij a_i.b_j = mean(a).mean(b). The mean of a CSR
+#descriptor stays a sparse 1 x features row. weights (e.g. symmetry
+#multiplicities of representative sites) give a weighted mean
+def average_vector(desc, weights = None):
+    if weights is None:
+        if sp.issparse(desc):
+            return sp.csr_matrix(np.full((1, desc.shape[0]), 1 / desc.shape[0])) @ desc
+        return np.asarray(desc).mean(axis = 0)
+    weights = np.asarray(weights, dtype = np.float64) / np.sum(weights)
+    if sp.issparse(desc):
+        return sp.csr_matrix(weights[None, :]) @ desc
+    return weights @ np.asarray(desc)
+
+
+#Stack mean vectors into one matrix, CSR if any of them is sparse
+def stack_means(means, dtype = np.float64):
+    if sp.issparse(means):
+        return means.tocsr().astype(dtype, copy = False)
+    if any(sp.issparse(m) for m in means):
+        return sp.vstack([sp.csr_matrix(m) for m in means], format = 'csr', dtype = dtype)
+    return np.asarray(means, dtype = dtype)
+
+
+#Join row blocks of mean vectors (e.g. chunks restored from a checkpoint)
+def concat_means(blocks, dtype = np.float64):
+    if any(sp.issparse(b) for b in blocks):
+        return sp.vstack(blocks, format = 'csr', dtype = dtype)
+    return np.concatenate(blocks).astype(dtype, copy = False)
+
+
+def average_vectors(descriptors, dtype = np.float64, weights = None):
+    weights = [None] * len(descriptors) if weights is None else weights
+    return stack_means([average_vector(d, w) for d, w in zip(descriptors, weights)], dtype)
+
+
+def unit_means(means):
+    if sp.issparse(means):
+        norms = np.sqrt(np.asarray(means.multiply(means).sum(axis = 1)).ravel())
+        return sp.diags(1 / norms) @ means
+    return means / np.sqrt(np.einsum('ij,ij->i', means, means))[:, None]
+
+
+#Largest absolute difference between a kernel and a reference, e.g. a
+#float32 kernel against the float64 one. With upper only the upper triangles
+#are compared
+def max_deviation(kern, ref, upper = False):
+    diff = np.abs(np.asarray(kern, dtype = np.float64) - np.asarray(ref, dtype = np.float64))
+    return float(np.triu(diff).max() if upper else diff.max())
+
+
+#Normalised linear AVERAGE kernel, identical to
+#AverageKernel(metric = 'linear').create(descriptors), as a Gram matrix of
+#unit mean vectors. The matrix is filled in block x block tiles with one BLAS
+#product per tile, only tiles on or above the diagonal are computed and are
+#mirrored unless upper = True (the lower triangle is then left at zero).
+#Passing a file name for out writes the tiles into a memory-mapped .npy file.
+#Sparse mean vectors are multiplied as CSR and only the tiles made dense.
+#dtype = np.float32 does the arithmetic and stores the kernel in single
+#precision, halving memory and roughly doubling BLAS throughput.
+#For checkpointing, on_block(i0) is called once the row block starting at i0
+#is complete (and flushed to out), and row blocks listed in done are skipped
+#in an existing out file
+def average_kernel(means, block = 512, out = None, upper = False, dtype = np.float64, done = (), on_block = None):
+    means = stack_means(means, dtype)
+    n = means.shape[0]
+    unit = unit_means(means)
+
+    if out is None:
+        kern = np.zeros((n, n), dtype = dtype)
+    elif done:
+        kern = np.load(out, mmap_mode = 'r+')
+    else:
+        kern = np.lib.format.open_memmap(out, mode = 'w+', dtype = dtype, shape = (n, n))
+
+    for i0 in range(0, n, block):
+        if i0 in done:
+            continue
+        i1 = min(i0 + block, n)
+        for j0 in range(i0, n, block):
+            j1 = min(j0 + block, n)
+            tile = unit[i0:i1] @ unit[j0:j1].T
+            if sp.issparse(tile):
+                tile = tile.toarray()
+            if j0 == i0 and upper:
+                tile = np.triu(tile)
+            kern[i0:i1, j0:j1] = tile
+            if j0 != i0 and not upper:
+                kern[j0:j1, i0:i1] = tile.T
+        if on_block is not None:
+            if out is not None:
+                kern.flush()
+            on_block(i0)
+
+    if out is not None:
+        kern.flush()
+    return kern
@@ -0,0 +1,164 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import importlib.util
+import numpy as np
+
+#---------------------------------------------------------------------
+#KERNEL MATRIX OUTPUT FORMATS
+#---------------------------------------------------------------------
+
+FORMATS = ['csv', 'npy', 'npz', 'parquet', 'hdf5', 'packed']
+EXTENSIONS = {'csv': '.csv', 'npy': '.npy', 'npz': '.npz', 'parquet': '.parquet', 'hdf5': '.h5', 'packed': '.packed.npy'}
+
+
+#Why a format cannot be written here (its optional packages are missing), or
+#None. Only looks the packages up, so a run can fail before any work is done
+def missing_dependency(fmt):
+    found = lambda name: importlib.util.find_spec(name) is not None
+    if fmt == 'parquet' and not (found('pandas') and (found('pyarrow') or found('fastparquet'))):
+        return "--format parquet needs pandas with pyarrow or fastparquet installed"
+    if fmt == 'hdf5' and not found('h5py'):
+        return "--format hdf5 needs h5py installed"
+    return None
+
+
+def names_path(path):
+    return path + '.names.txt'
+
+
+def write_names(path, names):
+    with open(names_path(path), 'w') as f:
+        f.write('\n'.join(names) + '\n')
+
+
+def read_names(path):
+    with open(names_path(path)) as f:
+        return f.read().splitlines()
+
+
+#Index of K[i,i] in the row-major packed upper triangle (diagonal included)
+def packed_offset(i, n):
+    return i * n - i * (i - 1) // 2
+
+
+#Write the symmetric kernel as its upper triangle, one row at a time so a
+#memory-mapped kernel never has to be loaded whole
+def save_packed(kern, names, path):
+    n = len(names)
+    packed = np.lib.format.open_memmap(path, mode = 'w+', dtype = kern.dtype, shape = (n * (n + 1) // 2,))
+    for i in range(n):
+        start = packed_offset(i, n)
+        packed[start:start + n - i] = kern[i, i:]
+    packed.flush()
+    write_names(path, names)
+
+
+#Save a sparse kernel (e.g. the REMatch values of a screening cascade) as a
+#scipy .npz with a names sidecar, plus its stats as JSON, and return the name
+def save_sparse_kernel(kern, names, base, stats = None):
+    import json
+    import scipy.sparse as sp
+    path = base + '.npz'
+    sp.save_npz(path, kern.tocsr())
+    write_names(path, list(names))
+    if stats is not None:
+        with open(base + '.json', 'w') as f:
+            json.dump(stats, f, indent = 1)
+    return path
+
+
+#Save the kernel under base + format extension and return the file name.
+#Binary formats without room for labels get a .names.txt sidecar
+def save_kernel(kern, names, base, fmt = 'csv'):
+    path = base + EXTENSIONS[fmt]
+    names = list(names)
+
+    if fmt == 'csv':
+        import pandas as pd
+        soap_array = pd.DataFrame(kern, index = names, columns = names)
+        soap_array.to_csv(path, index = True, header = True, sep = ',')
+    elif fmt == 'npy':
+        np.save(path, kern)
+        write_names(path, names)
+    elif fmt == 'npz':
+        np.savez_compressed(path, kernel = kern, names = np.array(names))
+        write_names(path, names)
+    elif fmt == 'parquet':
+        import pandas as pd
+        pd.DataFrame(np.asarray(kern), index = names, columns = names).to_parquet(path)
+    elif fmt == 'hdf5':
+        import h5py
+        n = len(names)
+        chunk = min(n, 256)
+        with h5py.File(path, 'w') as f:
+            dset = f.create_dataset('kernel', shape = (n, n), dtype = kern.dtype, chunks = (chunk, chunk),
+                                    compression = 'gzip', shuffle = True)
+            for i0 in range(0, n, chunk):
+                dset[i0:i0 + chunk] = kern[i0:i0 + chunk]
+            f.create_dataset('names', data = np.array(names, dtype = h5py.string_dtype()))
+    elif fmt == 'packed':
+        save_packed(kern, names, path)
+    else:
+        raise ValueError(f"Unknown kernel format {fmt}, choose from {FORMATS}")
+    return path
+
+#---------------------------------------------------------------------
+#LOADERS
+#---------------------------------------------------------------------
+
+#Memory-mapped view of a packed upper-triangle kernel. Rows and single
+#entries are read from disk on demand
+class PackedKernel:
+
+    def __init__(self, path):
+        self.path = path
+        self.names = read_names(path)
+        self.n = len(self.names)
+        self.packed = np.load(path, mmap_mode = 'r')
+        self.shape = (self.n, self.n)
+
+    def index(self, name):
+        return self.names.index(name)
+
+    def __getitem__(self, ij):
+        i, j = sorted(ij)
+        return self.packed[packed_offset(i, self.n) + j - i]
+
+    #Row i: K[j,i] for j < i is picked out of earlier packed rows, K[i,j]
+    #for j >= i is one contiguous run
+    def row(self, i):
+        n = self.n
+        out = np.empty(n, dtype = self.packed.dtype)
+        j = np.arange(i)
+        out[:i] = self.packed[j * n - j * (j - 1) // 2 + i - j]
+        start = packed_offset(i, n)
+        out[i:] = self.packed[start:start + n - i]
+        return out
+
+    def to_dense(self):
+        return np.vstack([self.row(i) for i in range(self.n)])
+
+
+#Load a kernel written by save_kernel and return (kernel, names). .npy
+#kernels are memory-mapped, packed kernels come back as a PackedKernel
+def load_kernel(path):
+    if path.endswith(EXTENSIONS['packed']):
+        kern = PackedKernel(path)
+        return kern, kern.names
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode = 'r'), read_names(path)
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return data['kernel'], [str(s) for s in data['names']]
+    import pandas as pd
+    if path.endswith('.parquet'):
+        frame = pd.read_parquet(path)
+        return frame.values, list(frame.index)
+    if path.endswith('.h5'):
+        import h5py
+        with h5py.File(path, 'r') as f:
+            return f['kernel'][()], [s.decode() if isinstance(s, bytes) else s for s in f['names'][()]]
+    frame = pd.read_csv(path, index_col = 0)
+    return frame.values, list(frame.index)
@@ -0,0 +1,50 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
+from soap_cache import create_soap, descriptor_bytes
+
+#---------------------------------------------------------------------
+#PARALLEL DESCRIPTOR GENERATION
+#---------------------------------------------------------------------
+
+#Worker job - returns the descriptor and the CPU time spent producing it,
+#which unlike wall time is not inflated when workers share cores, plus the
+#epoch start time, wall time and worker pid for tracing
+def _descriptor_job(job):
+    structure, path, params = job
+    start = time.time()
+    tic = time.perf_counter()
+    cpu = time.process_time()
+    desc = create_soap(structure, path, params)
+    if not sp.issparse(desc):
+        desc = np.asarray(desc)
+    return desc, time.process_time() - cpu, start, time.perf_counter() - tic, os.getpid()
+
+
+#Create descriptors for a list of structures across a process pool. Output
+#order always follows the input order. Returns the descriptors, the wall time
+#and the summed per-structure CPU time (i.e. what a serial run would have taken).
+#A timings list, if given, is extended with one record per structure
+def create_descriptors(structures, files, params, workers = 1, chunksize = 1, timings = None):
+    jobs = [(s, f, params) for s, f in zip(structures, files)]
+
+    tic = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            results = list(pool.map(_descriptor_job, jobs, chunksize = chunksize))
+    else:
+        results = [_descriptor_job(j) for j in jobs]
+    wall = time.perf_counter() - tic
+
+    descriptors = [r[0] for r in results]
+    serial = sum(r[1] for r in results)
+    if timings is not None:
+        timings.extend({'path': f, 'atoms': len(s), 'bytes': descriptor_bytes(r[0]), 'cpu': r[1], 'start': r[2], 'wall': r[3], 'pid': r[4]}
+                       for s, f, r in zip(structures, files, results))
+    return descriptors, wall, serial
@@ -4,25 +4,26 @@
 
 import sys
 import os
-import gemmi
-import time
-import pandas as pd
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-from dscribe.descriptors import SOAP
-from ase import Atoms
-from ase.io import read
+from soap_sweep import run_sweep
+from soap_structures import load_structures
+from soap_checkpoint import Checkpoint
 
 #---------------------------------------------------------------------
 #SYSTEM PARAMETERS
 #---------------------------------------------------------------------
 
 # Check parameters
-if (len(sys.argv) != 3):
-    print("I require an input file!")
-    sys.exit()
-inputfile = sys.argv[1]
-outputdir = sys.argv[2]
+parser = argparse.ArgumentParser(description = "SOAP descriptor length and computation time across rcut, nmax and lmax")
+parser.add_argument("inputfile", help = "input CIF file")
+parser.add_argument("outputdir", help = "output directory")
+parser.add_argument("--workers", type = int, default = 1, help = "processes used to run grid points")
+parser.add_argument("--checkpoint", default = None, help = "directory where every finished sweep point is saved")
+parser.add_argument("--resume", action = "store_true", help = "skip sweep points already saved in the checkpoint")
+args = parser.parse_args()
+inputfile = args.inputfile
+outputdir = args.outputdir
 
 
 # Check that input file is appropriate
@@ -45,8 +46,13 @@ if not(os.path.isdir(outputdir)) :
 filename_split = inputfile.split("/")
 name = str(filename_split[len(filename_split)-1][:-4])
 
-#ase reader from inputfile
-structure = read(inputfile)
+#Parsed structure, from the binary structure store when it is up to date
+structure = load_structures([inputfile])[0]
+
+#Finished sweep points are saved as they complete and skipped on --resume
+checkpoint = None
+if args.checkpoint:
+    checkpoint = Checkpoint(args.checkpoint, {'script': 'soap_param_test.py', 'files': [os.path.abspath(inputfile)]}, resume = args.resume)
 ns = len(structure)
 
 #Determine atomic species
@@ -59,34 +65,29 @@ rbf_type = ['gto', 'polynomial']
 #---------------------------------------------------------------------------
 #RUN SOAP ACROSS RANGE OF NMAX VALUES AND PLOT ROWS, COLS, COMPUTATION TIME
 #---------------------------------------------------------------------------   
+#pandas and matplotlib are only needed once the sweep runs
+import pandas as pd
+import matplotlib.pyplot as plt
+
 xax = [i for i in range(1,10)]
 lmax = 1
 rcut = 10.0
 
-polycol = []
-gtocol = []
-polytime = []
-gtotime = []
-
-for nmax in range(1,10):
-    for rbf in rbf_type:
-        soapgen_rcut = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = rbf)
-    
-        tic_1 = time.perf_counter()
-        soap_rcut = soapgen_rcut.create(structure)
-        toc_1 = time.perf_counter()
-    
-        if rbf == 'gto':
-            gtocol.append(len(soap_rcut[0]))
-            gtotime.append(toc_1 - tic_1)
-        else:
-            polycol.append(len(soap_rcut[0]))
-            polytime.append(toc_1 - tic_1)
-
-rs = len(soap_rcut)
+spec = {'axes': {'nmax': range(1,10)}, 'fixed': {'lmax': lmax, 'rcut': rcut}, 'rbf': rbf_type, 'species': species}
+nmax_table = run_sweep([structure], [inputfile], spec, workers = args.workers, checkpoint = checkpoint)
+
+#Cached descriptors report the time of their original computation
+gto = nmax_table[nmax_table.rbf == 'gto']
+poly = nmax_table[nmax_table.rbf == 'polynomial']
+gtocol = list(gto.features)
+gtotime = list(gto.time)
+polycol = list(poly.features)
+polytime = list(poly.time)
+
+rs = nmax_table.rows.iloc[-1]
 print(f"rows = {rs}")
 
-vl = len(soap_rcut[0])
+vl = nmax_table.features.iloc[-1]
 print(f'maximum vector length: {vl}')
 
 polymax = polytime[-1]
@@ -122,25 +123,15 @@ xax = [i for i in range(1,9)]
 nmax = 1
 rcut = 10.0
 
-polycol = []
-gtocol = []
-polytime = []
-gtotime = []
-
-for lmax in range(1,9):
-    for rbf in rbf_type:
-        soapgen_rcut = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = rbf)
-    
-        tic_1 = time.perf_counter()
-        soap_rcut = soapgen_rcut.create(structure)
-        toc_1 = time.perf_counter()
-    
-        if rbf == 'gto':
-            gtocol.append(len(soap_rcut[0]))
-            gtotime.append(toc_1 - tic_1)
-        else:
-            polycol.append(len(soap_rcut[0]))
-            polytime.append(toc_1 - tic_1)
+spec = {'axes': {'lmax': range(1,9)}, 'fixed': {'nmax': nmax, 'rcut': rcut}, 'rbf': rbf_type, 'species': species}
+lmax_table = run_sweep([structure], [inputfile], spec, workers = args.workers, checkpoint = checkpoint)
+
+gto = lmax_table[lmax_table.rbf == 'gto']
+poly = lmax_table[lmax_table.rbf == 'polynomial']
+gtocol = list(gto.features)
+gtotime = list(gto.time)
+polycol = list(poly.features)
+polytime = list(poly.time)
             
 polymax = polytime[-1]
 gtomax = gtotime[-1]
@@ -174,27 +165,16 @@ plt.cla()
 lmax = 4
 nmax = 4
 
-rcutax = []
-polycol = []
-gtocol = []
-polytime = []
-gtotime = []
-
-for rcut in np.linspace(2,15,20):
-    rcutax.append(rcut)
-    for rbf in rbf_type:
-        soapgen_rcut = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = rbf)
-    
-        tic_1 = time.perf_counter()
-        soap_rcut = soapgen_rcut.create(structure)
-        toc_1 = time.perf_counter()
-    
-        if rbf == 'gto':
-            gtocol.append(len(soap_rcut[0]))
-            gtotime.append(toc_1 - tic_1)
-        else:
-            polycol.append(len(soap_rcut[0]))
-            polytime.append(toc_1 - tic_1)
+spec = {'axes': {'rcut': np.linspace(2,15,20)}, 'fixed': {'nmax': nmax, 'lmax': lmax}, 'rbf': rbf_type, 'species': species}
+rcut_table = run_sweep([structure], [inputfile], spec, workers = args.workers, checkpoint = checkpoint)
+
+gto = rcut_table[rcut_table.rbf == 'gto']
+poly = rcut_table[rcut_table.rbf == 'polynomial']
+rcutax = list(gto.rcut)
+gtocol = list(gto.features)
+gtotime = list(gto.time)
+polycol = list(poly.features)
+polytime = list(poly.time)
 
 polymax = polytime[-1]
 gtomax = gtotime[-1]
@@ -212,8 +192,8 @@ plt.legend()
 plt.savefig(outputdir+f"/{name}_time_nmax={nmax}_lmax={lmax}.png")
 plt.cla()
 
-plt.plot(xax, gtocol, label = 'Gaussian RBF')
-plt.plot(xax, polycol, label = 'Polynomial RBF')
+plt.plot(rcutax, gtocol, label = 'Gaussian RBF')
+plt.plot(rcutax, polycol, label = 'Polynomial RBF')
 plt.xlabel('r_cut (Angstroms)')
 plt.ylabel('Length of Local Descriptor')
 plt.title('nmax = {nmax}, lmax = {lmax} A')
@@ -222,4 +202,8 @@ plt.legend()
 plt.savefig(outputdir+f"/{name}_coeffs_nmax={nmax}_lmax={lmax}.png")
 plt.cla()
 
-
+#---------------------------------------------------------------------------
+#SAVE ALL SWEEP RESULTS AS ONE TABLE
+#---------------------------------------------------------------------------
+results = pd.concat([nmax_table.assign(sweep = 'nmax'), lmax_table.assign(sweep = 'lmax'), rcut_table.assign(sweep = 'rcut')])
+results.to_csv(outputdir+f"/{name}_sweep.csv", index = False)
@@ -0,0 +1,111 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import json
+import numpy as np
+import scipy.sparse as sp
+from soap_kernels import stack_means, average_kernel
+
+#---------------------------------------------------------------------
+#LINEAR PROJECTION OF MEAN VECTORS
+#---------------------------------------------------------------------
+
+# The linear AVERAGE kernel is a cosine between mean vectors, so any linear
+# map that (nearly) preserves dot products can shrink the feature length
+# before the N x N kernel is built. A projection is fitted on the mean vectors
+# of a sample of structures and then applied batch by batch.
+#   pca    - incremental PCA. The kernel needs uncentred dot products, so the
+#            basis is the sample mean direction plus n_components - 1 PCA
+#            components, orthonormalised
+#   random - sparse random projection (Johnson-Lindenstrauss), independent
+#            of the data apart from the feature length
+
+PROJECTIONS = ['pca', 'random']
+
+
+class Projection:
+
+    def __init__(self, method = 'pca', n_components = 128, params = None, seed = 0, batch = 1024):
+        if method not in PROJECTIONS:
+            raise ValueError(f"Unknown projection {method}, choose from {PROJECTIONS}")
+        if method == 'pca' and n_components < 2:
+            raise ValueError("pca needs at least 2 components, the mean direction and one principal component")
+        self.method = method
+        self.n_components = n_components
+        self.params = params
+        self.seed = seed
+        self.batch = batch
+        self.matrix = None
+
+    #Fit on a sample of mean vectors (n x features, dense or CSR). PCA is fed
+    #to IncrementalPCA in batches, and can keep at most as many components
+    #(the mean direction included) as there are sample structures
+    def fit(self, sample):
+        sample = stack_means(sample)
+        n, n_features = sample.shape
+        if self.method == 'random':
+            from sklearn.random_projection import SparseRandomProjection
+            rp = SparseRandomProjection(n_components = self.n_components, random_state = self.seed)
+            rp.fit(sample[:1])
+            self.matrix = sp.csr_matrix(rp.components_.T)
+            return self
+
+        from sklearn.decomposition import IncrementalPCA
+        k = min(self.n_components - 1, n - 1, n_features - 1)
+        pca = IncrementalPCA(n_components = k)
+        size = max(self.batch, k)
+        for i0 in range(0, n, size):
+            rows = sample[i0:i0 + size]
+            if i0 and rows.shape[0] < k:
+                break
+            pca.partial_fit(rows.toarray() if sp.issparse(rows) else rows)
+        basis = np.vstack([pca.mean_ / np.linalg.norm(pca.mean_), pca.components_]).T
+        self.matrix = np.linalg.qr(basis)[0]
+        return self
+
+    def transform(self, means):
+        means = stack_means(means)
+        projected = means @ self.matrix
+        return projected.toarray() if sp.issparse(projected) else np.asarray(projected)
+
+    #Project an iterable of mean vectors `batch` rows at a time, yielding one
+    #projected row per input
+    def transform_stream(self, means):
+        pending = []
+        for m in means:
+            pending.append(m)
+            if len(pending) == self.batch:
+                yield from self.transform(pending)
+                pending = []
+        if pending:
+            yield from self.transform(pending)
+
+    #Largest and mean absolute difference between the kernel of the projected
+    #vectors and the full-length kernel over the given mean vectors
+    def kernel_error(self, means):
+        means = stack_means(means)
+        diff = np.abs(average_kernel(self.transform(means)) - average_kernel(means))
+        return float(diff.max()), float(diff.mean())
+
+    def save(self, path):
+        settings = {'method': self.method, 'n_components': self.n_components, 'params': self.params,
+                    'seed': self.seed, 'batch': self.batch}
+        if sp.issparse(self.matrix):
+            arrays = {'data': self.matrix.data, 'indices': self.matrix.indices, 'indptr': self.matrix.indptr,
+                      'shape': self.matrix.shape}
+        else:
+            arrays = {'matrix': self.matrix}
+        #Written through a file object so numpy does not append .npz
+        with open(path, 'wb') as f:
+            np.savez(f, settings = json.dumps(settings), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            proj = cls(**json.loads(str(data['settings'])))
+            if 'matrix' in data:
+                proj.matrix = data['matrix']
+            else:
+                proj.matrix = sp.csr_matrix((data['data'], data['indices'], data['indptr']), shape = tuple(data['shape']))
+        return proj
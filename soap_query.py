@@ -0,0 +1,88 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import sys
+import os
+import time
+import argparse
+from ase.io import read
+from soap_cache import soap_params, create_soap
+from soap_stream import walk_cifs, stream_means
+from soap_kernels import average_vector
+from soap_index import MODES, SimilarityIndex
+
+#---------------------------------------------------------------------
+#SYSTEM PARAMETERS
+#---------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(description = "Top-k most similar structures by AVERAGE kernel, from an index of averaged SOAP vectors")
+commands = parser.add_subparsers(dest = "command", required = True)
+
+build = commands.add_parser("build", help = "index the first n CIF files of a directory")
+build.add_argument("inputdir", help = "input directory of CIF files")
+build.add_argument("index", help = "index file to write (.npz)")
+build.add_argument("--n", type = int, default = None, help = "number of files")
+build.add_argument("--mode", choices = MODES, default = "lsh", help = "search mode stored with the index")
+build.add_argument("--workers", type = int, default = 1, help = "processes used to create descriptors")
+build.add_argument("--rcut", type = float, default = 20.0)
+build.add_argument("--nmax", type = int, default = 16)
+build.add_argument("--lmax", type = int, default = 9)
+build.add_argument("--species", default = "C,H,O,N", help = "comma separated species list")
+build.add_argument("--recall-sample", type = int, default = 100, help = "indexed structures used as queries to estimate recall")
+
+query = commands.add_parser("query", help = "find the structures most similar to a CIF file")
+query.add_argument("index", help = "index file written by build")
+query.add_argument("cif", help = "structure to look up")
+query.add_argument("--k", type = int, default = 10, help = "number of neighbours")
+query.add_argument("--mode", choices = MODES, default = None, help = "override the index's search mode")
+
+args = parser.parse_args()
+
+#---------------------------------------------------------------------
+#BUILD INDEX FROM INPUT DIRECTORY
+#---------------------------------------------------------------------
+if args.command == "build":
+    if not os.path.isdir(args.inputdir):
+        print("First parameter must be a directory!")
+        sys.exit()
+
+    params = soap_params(species = args.species.split(","), rcut = args.rcut, nmax = args.nmax, lmax = args.lmax, periodic = True, sparse = False)
+
+    tic_1 = time.perf_counter()
+    names = []
+    means = []
+    for name, mean in stream_means(walk_cifs(args.inputdir, args.n), params, workers = args.workers):
+        names.append(name)
+        means.append(mean)
+    index = SimilarityIndex(names, means, params = params, mode = args.mode)
+    index.save(args.index)
+    toc_1 = time.perf_counter()
+
+    print(f"Indexed {len(names)} structures in {toc_1 - tic_1:.2} seconds ({args.mode} mode)")
+    if args.mode != "exact":
+        sample = min(args.recall_sample, len(names))
+        print(f"recall@10 against exact AVERAGE kernel over {sample} sampled structures: {index.recall(index.vectors, 10, sample = sample):.3f}")
+
+#---------------------------------------------------------------------
+#QUERY A NEW STRUCTURE
+#---------------------------------------------------------------------
+else:
+    if not os.path.isfile(args.cif):
+        print("Second parameter must be a file!")
+        sys.exit()
+
+    index = SimilarityIndex.load(args.index, mode = args.mode)
+
+    tic_1 = time.perf_counter()
+    mean = average_vector(create_soap(read(args.cif), args.cif, index.params))
+    tic_2 = time.perf_counter()
+    hits = index.query(mean, args.k)
+    toc_2 = time.perf_counter()
+
+    for name, score in hits:
+        print(f"{name}\t{score:.6f}")
+
+    print(f"Descriptor took {(tic_2 - tic_1) * 1e3:.1f} ms, {index.mode} search took {(toc_2 - tic_2) * 1e3:.2f} ms")
+    if index.mode != "exact":
+        print(f"recall@{args.k} against exact AVERAGE kernel: {index.recall(mean, args.k):.3f}")
@@ -0,0 +1,157 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import itertools
+import numpy as np
+
+#---------------------------------------------------------------------
+#BATCHED REMATCH KERNEL
+#---------------------------------------------------------------------
+
+# Same result as
+#   REMatchKernel(metric = 'rbf', gamma = gamma, alpha = alpha, threshold = threshold).create(...)
+# on the (optionally normalised) descriptors, but each descriptor is
+# normalised once, environment similarities are plain matrix products and the
+# Sinkhorn balancing runs for a whole batch of structure pairs at once. Pairs
+# drop out of the iteration individually as they converge.
+
+#Scale every local environment to unit length, as sklearn's normalize does
+def normalize_rows(desc):
+    desc = np.asarray(desc, dtype = np.float64)
+    norms = np.sqrt(np.einsum('ij,ij->i', desc, desc))
+    norms[norms == 0] = 1
+    return desc / norms[:, None]
+
+
+#RBF similarity between the environments of two structures. For a structure
+#against itself the squared distances on the diagonal are exactly zero, as
+#in sklearn's pairwise_kernels
+def local_kernel(a, b, gamma = 1, sq_a = None, sq_b = None, same = False):
+    sq_a = np.einsum('ij,ij->i', a, a) if sq_a is None else sq_a
+    sq_b = np.einsum('ij,ij->i', b, b) if sq_b is None else sq_b
+    d2 = sq_a[:, None] + sq_b[None, :] - 2 * (a @ b.T)
+    np.maximum(d2, 0, out = d2)
+    if same:
+        np.fill_diagonal(d2, 0)
+    return np.exp(-gamma * d2)
+
+
+#Regularised-entropy match of a batch of local kernels (list of n_i x m_i
+#arrays). Kernels are zero-padded into one stack with masks; the iteration
+#and convergence test follow dscribe's REMatchKernel step for step.
+#Marginals, if given, are one (row weights, column weights) pair per kernel,
+#either of which may be None for dscribe's uniform weights. Weighting a
+#symmetry-unique environment by its multiplicity gives the same match as
+#repeating it once per atom of its orbit
+def sinkhorn_batch(local, alpha = 1, threshold = 1e-6, marginals = None):
+    p = len(local)
+    n = np.array([c.shape[0] for c in local])
+    m = np.array([c.shape[1] for c in local])
+    rows = np.arange(n.max())[None, :] < n[:, None]
+    cols = np.arange(m.max())[None, :] < m[:, None]
+
+    C = np.zeros((p, n.max(), m.max()))
+    for k, c in enumerate(local):
+        C[k, :n[k], :m[k]] = c
+    K = np.exp(-(1 - C) / alpha) * rows[:, :, None] * cols[:, None, :]
+
+    en = rows / n[:, None]
+    em = cols / m[:, None]
+    for k, (wr, wc) in enumerate(marginals or []):
+        if wr is not None:
+            en[k, :n[k]] = np.asarray(wr, dtype = np.float64) / np.sum(wr)
+        if wc is not None:
+            em[k, :m[k]] = np.asarray(wc, dtype = np.float64) / np.sum(wc)
+    u = en.copy()
+    v = em.copy()
+    error = np.ones(p)
+    active = np.arange(p)
+    itercount = 0
+    while len(active):
+        Ka = K[active]
+        uprev = u[active]
+        vprev = v[active]
+        KTu = np.matmul(uprev[:, None, :], Ka)[:, 0, :]
+        vnew = np.divide(em[active], KTu, out = np.zeros_like(KTu), where = cols[active])
+        Kv = np.matmul(Ka, vnew[:, :, None])[:, :, 0]
+        unew = np.divide(en[active], Kv, out = np.zeros_like(Kv), where = rows[active])
+
+        if itercount % 5:
+            error[active] = (np.sum((unew - uprev) ** 2, axis = 1) / np.sum(unew ** 2, axis = 1) +
+                             np.sum((vnew - vprev) ** 2, axis = 1) / np.sum(vnew ** 2, axis = 1))
+        u[active] = unew
+        v[active] = vnew
+        itercount += 1
+        active = active[error[active] > threshold]
+
+    return np.einsum('pij,pi,pj->p', K * C, u, v)
+
+
+#Match an iterable of local kernels, `batch` at a time. The kernels are
+#pulled from the iterable per batch, so only one batch of them is ever held.
+#Marginals, if given, is an iterable running alongside
+def _match(local, alpha, threshold, batch, marginals = None):
+    items = iter(zip(local, marginals) if marginals is not None else ((c, None) for c in local))
+    out = []
+    while True:
+        chunk = list(itertools.islice(items, batch))
+        if not chunk:
+            break
+        weights = [w for c, w in chunk] if marginals is not None else None
+        out.append(sinkhorn_batch([c for c, w in chunk], alpha, threshold, weights))
+    return np.concatenate(out) if out else np.empty(0)
+
+
+#Full normalised REMatch kernel matrix for a list of descriptors
+def rematch_kernel(descriptors, alpha = 1, gamma = 1, threshold = 1e-6, normalize = True, batch = 256):
+    descs = [normalize_rows(d) if normalize else np.asarray(d, dtype = np.float64) for d in descriptors]
+    sq = [np.einsum('ij,ij->i', d, d) for d in descs]
+    pairs = [(i, j) for i in range(len(descs)) for j in range(i, len(descs))]
+
+    local = (local_kernel(descs[i], descs[j], gamma, sq[i], sq[j], same = (i == j)) for i, j in pairs)
+    glosim = _match(local, alpha, threshold, batch)
+
+    kern = np.empty((len(descs), len(descs)))
+    for (i, j), g in zip(pairs, glosim):
+        kern[i, j] = kern[j, i] = g
+    diag = np.sqrt(np.diagonal(kern).copy())
+    return kern / np.outer(diag, diag)
+
+
+#Normalised REMatch similarity of each pair (first[k], second[k]). Pairs may
+#differ in size and feature length, all their Sinkhorn problems (including
+#the self-similarities used for normalisation) are solved together
+def rematch_pairs(first, second, alpha = 1, gamma = 1, threshold = 1e-6, normalize = True, batch = 256):
+    prep = (lambda d: normalize_rows(d)) if normalize else (lambda d: np.asarray(d, dtype = np.float64))
+
+    def local():
+        for a, b in zip(first, second):
+            a = prep(a)
+            b = prep(b)
+            yield local_kernel(a, b, gamma)
+            yield local_kernel(a, a, gamma, same = True)
+            yield local_kernel(b, b, gamma, same = True)
+
+    glosim = _match(local(), alpha, threshold, batch).reshape(-1, 3)
+    return glosim[:, 0] / np.sqrt(glosim[:, 1] * glosim[:, 2])
+
+
+#Normalised REMatch similarity for selected (i, j) index pairs of one
+#descriptor list. Every structure is normalised once and its self-similarity
+#solved once, however many of the pairs it takes part in. Weights, if
+#given, hold each structure's environment multiplicities (None for uniform)
+def rematch_selected(descriptors, pairs, alpha = 1, gamma = 1, threshold = 1e-6, normalize = True, batch = 256, weights = None):
+    used = sorted({i for pair in pairs for i in pair})
+    prep = (lambda d: normalize_rows(d)) if normalize else (lambda d: np.asarray(d, dtype = np.float64))
+    descs = {i: prep(descriptors[i]) for i in used}
+    sq = {i: np.einsum('ij,ij->i', d, d) for i, d in descs.items()}
+
+    local = itertools.chain((local_kernel(descs[i], descs[i], gamma, sq[i], sq[i], same = True) for i in used),
+                            (local_kernel(descs[i], descs[j], gamma, sq[i], sq[j]) for i, j in pairs))
+    marginals = None
+    if weights is not None:
+        marginals = itertools.chain(((weights[i], weights[i]) for i in used), ((weights[i], weights[j]) for i, j in pairs))
+    glosim = _match(local, alpha, threshold, batch, marginals)
+    self_sim = dict(zip(used, glosim[:len(used)]))
+    return np.array([g / np.sqrt(self_sim[i] * self_sim[j]) for (i, j), g in zip(pairs, glosim[len(used):])])
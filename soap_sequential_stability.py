@@ -3,28 +3,32 @@
 #---------------------------------------------------------------------
 import sys
 import os
-import gemmi
-import time
-import pandas as pd
+import argparse
+import csv
 import numpy as np
-import matplotlib.pyplot as plt
-from dscribe.descriptors import SOAP
-from dscribe.kernels import AverageKernel
-from dscribe.kernels import REMatchKernel
-from ase import Atoms
-from ase.io import read
-from sklearn.preprocessing import normalize
+from soap_sweep import run_sweep
+from soap_rematch import rematch_pairs
+from soap_slicer import padded_pair
+from soap_structures import load_structures
+from soap_checkpoint import Checkpoint
+from soap_converge import ConvergenceSearch, environment_match
 
 #---------------------------------------------------------------------
 #SYSTEM PARAMETERS
 #---------------------------------------------------------------------
 
 # Check parameters
-if (len(sys.argv) != 3):
-    print("I require an input directory!")
-    sys.exit()
-testfile = sys.argv[1]
-outputdir = sys.argv[2]
+parser = argparse.ArgumentParser(description = "Kernel match between SOAP descriptors at successive rcut, nmax and lmax values")
+parser.add_argument("testfile", help = "input CIF file")
+parser.add_argument("outputdir", help = "output directory")
+parser.add_argument("--workers", type = int, default = 1, help = "processes used to run grid points")
+parser.add_argument("--checkpoint", default = None, help = "directory where every finished sweep point is saved")
+parser.add_argument("--resume", action = "store_true", help = "skip sweep points already saved in the checkpoint")
+parser.add_argument("--adaptive", action = "store_true", help = "bisect each axis for its convergence point instead of sweeping the full grid")
+parser.add_argument("--tol", type = float, default = 1e-3, help = "convergence tolerance on 1 - kernel match with the previous value (adaptive mode)")
+args = parser.parse_args()
+testfile = args.testfile
+outputdir = args.outputdir
 
 
 # Check that input file is appropriate
@@ -41,14 +45,25 @@ if not(os.path.isdir(outputdir)):
 #USING THE AVERAGE AND REMAX METHODS AND TO OUTPUT THE COMPARISON FIGURE INTO A NEW LIST
 #-----------------------------------------------------------------------------------------------
 
+#Pair each descriptor of an lmax or rcut sweep with its successor in their
+#common layout (same species pair, l, n1, n2), the smaller one zero-padded so
+#the angular channels added at the next lmax value show up in the match
+def aligned_pairs(desc_list, table):
+    comp_pairs = []
+    for i in range(0, len(desc_list)-1):
+        comp_pairs.append(list(padded_pair(desc_list[i], desc_list[i+1], species, table.nmax.iloc[i], table.lmax.iloc[i],
+                                           table.nmax.iloc[i+1], table.lmax.iloc[i+1])))
+    return comp_pairs
+
+
 #Average Kernel Method
-def average_listcomp(desc_list):
+def average_listcomp(comp_pairs):
+    from dscribe.kernels import AverageKernel
     re = AverageKernel(metric = 'linear')
     av_comp_list = []
     loop_count = 0
     
-    for i in range(0, len(desc_list)-1):
-        comp_pair = [desc_list[i], desc_list[i+1][:,0:len(desc_list[i][0])]]
+    for comp_pair in comp_pairs:
         print([len(comp_pair[0]), len(comp_pair[1])])
         print([len(comp_pair[0][0]), len(comp_pair[1][0])])
         kern = re.create(comp_pair)
@@ -59,18 +74,13 @@ def average_listcomp(desc_list):
     return av_comp_list
         
 
-#REMax Kernel Method       
-def remax_listcomp(desc_list):
-    re = REMatchKernel(metric = 'rbf', gamma = 1,alpha = 1, threshold = 1e-6)
-    re_comp_list = []
+#REMax Kernel Method - all neighbouring pairs are matched in one batch
+def remax_listcomp(comp_pairs):
+    first = [p[0] for p in comp_pairs]
+    second = [p[1] for p in comp_pairs]
+    re_comp_list = rematch_pairs(first, second, alpha = 1, gamma = 1, threshold = 1e-6)
 
-    for i in range(0, len(desc_list)-1):
-        comp_pair = [desc_list[i], desc_list[i+1][:,0:len(desc_list[i][0])]]
-        norm_pair = [normalize(j) for j in comp_pair]
-        kern = re.create(norm_pair)
-        re_comp_list.append(kern[0][1])
-
-    return re_comp_list      
+    return list(re_comp_list)
 
 #---------------------------------------------------------------------
 #EXTRACT LIST OF FILES FROM INPUTDIR, MAKE FILENAMES
@@ -82,13 +92,46 @@ test_filename_split = testfile.split("/")
 test_name = test_filename_split[-1][:-4]
 
 #Read structure and species
-structure = read(testfile)
+structure = load_structures([testfile])[0]
+
+#Finished sweep points are saved as they complete and skipped on --resume
+checkpoint = None
+if args.checkpoint:
+    checkpoint = Checkpoint(args.checkpoint, {'script': 'soap_sequential_stability.py', 'files': [os.path.abspath(testfile)]}, resume = args.resume)
 species = ['C', 'H', 'O', 'N']
 
+#-----------------------------------------------------------------------------------------------
+#ADAPTIVE MODE - BISECT EACH AXIS OF THE SAME GRIDS FOR THE FIRST CONVERGED VALUE
+#-----------------------------------------------------------------------------------------------
+if args.adaptive:
+    searches = [ConvergenceSearch(structure, testfile, 'nmax', range(1,10), {'lmax': 4, 'rcut': 20.0}, species, tol = args.tol),
+                ConvergenceSearch(structure, testfile, 'lmax', range(1,10), {'nmax': 4, 'rcut': 20.0}, species, tol = args.tol),
+                ConvergenceSearch(structure, testfile, 'rcut', np.linspace(2,20,30), {'nmax': 4, 'lmax': 4}, species, tol = args.tol)]
+    rows = []
+    for search in searches:
+        result = search.run()
+        if result['value'] is None:
+            print(f"{result['axis']}: not converged to {args.tol:g} on the grid ({result['evaluations']} of {result['grid']} SOAP evaluations)")
+        else:
+            print(f"{result['axis']}: converged at {result['value']:g} (match {result['match']:.9f}, "
+                  f"{'confirmed' if result['confirmed'] else 'last grid value'}) with {result['evaluations']} of {result['grid']} SOAP evaluations")
+            if result['trivial']:
+                print(f"{result['axis']}: warning, the channels added at {result['value']:g} are empty, so this match says nothing about convergence")
+        rows += [dict(row, sweep = result['axis']) for row in search.table()]
+    with open(outputdir+f"/{test_name}_converge.csv", 'w', newline = '') as f:
+        writer = csv.DictWriter(f, fieldnames = list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    sys.exit()
+
 
 #-----------------------------------------------------------------------------------------------
 #RUN STABILITY COMPARISON FOR RANGE OF RADIAL BASIS FUNCTIONS
 #-----------------------------------------------------------------------------------------------   
+#pandas and matplotlib are only needed once the sweep runs
+import pandas as pd
+import matplotlib.pyplot as plt
+
 print('starting RBF comparison')
 #Set up plot axis and fixed parameters
 xax = [i for i in range(1,9)]
@@ -96,21 +139,21 @@ lmax = 4
 rcut = 20.0
 
 #Make descriptor list
-descriptors = []
-for nmax in range(1,10):
-    soapgen = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = 'gto')
-    descriptors.append(soapgen.create(structure))
+spec = {'axes': {'nmax': range(1,10)}, 'fixed': {'lmax': lmax, 'rcut': rcut}, 'species': species}
+nmax_table, descriptors = run_sweep([structure], [testfile], spec, workers = args.workers, checkpoint = checkpoint, keep_descriptors = True)
+descriptors = [d[0] for d in descriptors]
 
 
-#Make comparison list
-kerndiffs = average_listcomp(descriptors)
-remkerndiffs = remax_listcomp(descriptors)
+#dscribe builds a new radial basis for every nmax, so features of successive
+#nmax values do not correspond and the AVERAGE/REMatch kernels between them
+#mean nothing. The environment Gram match is independent of the basis
+envdiffs = [environment_match(descriptors[i], descriptors[i+1]) for i in range(len(descriptors)-1)]
+nmax_table['environment'] = [np.nan] + envdiffs
 
-#Plot kernel calculation by comparison
-plt.plot(xax, kerndiffs, label = 'Average Kernel')
-plt.plot(xax, remkerndiffs, label = 'REMatch Kernel')
+#Plot environment match by comparison
+plt.plot(xax, envdiffs, label = 'Environment Gram match')
 plt.xlabel('Number of radial basis functions')
-plt.ylabel('Kernel match')
+plt.ylabel('Match with previous nmax')
 plt.title(f'lmax = {lmax}, rcut = {rcut}')
 plt.legend()
 
@@ -127,14 +170,16 @@ nmax = 4
 rcut = 20.0
 
 #Make descriptor list
-descriptors = []
-for lmax in range(1,10):
-    soapgen = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = 'gto')
-    descriptors.append(soapgen.create(structure))
+spec = {'axes': {'lmax': range(1,10)}, 'fixed': {'nmax': nmax, 'rcut': rcut}, 'species': species, 'slice_lmax': True}
+lmax_table, descriptors = run_sweep([structure], [testfile], spec, workers = args.workers, checkpoint = checkpoint, keep_descriptors = True)
+descriptors = [d[0] for d in descriptors]
 
 #Make comparison list
-kerndiffs = average_listcomp(descriptors)
-remkerndiffs = remax_listcomp(descriptors)
+comp_pairs = aligned_pairs(descriptors, lmax_table)
+kerndiffs = average_listcomp(comp_pairs)
+remkerndiffs = remax_listcomp(comp_pairs)
+lmax_table['average'] = [np.nan] + kerndiffs
+lmax_table['rematch'] = [np.nan] + remkerndiffs
 
 #Plot kernel calculation by comparison
 plt.plot(xax, kerndiffs, label = 'Average Kernel')
@@ -152,18 +197,19 @@ plt.cla()
 print('starting rcut comparison')
 nmax = 4
 lmax = 4
-xax = []
 
-descriptors = []
-for rcut in np.linspace(2,20,30):
-    xax.append(rcut)
-    soapgen = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = 'gto')
-    descriptors.append(soapgen.create(structure))
+spec = {'axes': {'rcut': np.linspace(2,20,30)}, 'fixed': {'nmax': nmax, 'lmax': lmax}, 'species': species}
+rcut_table, descriptors = run_sweep([structure], [testfile], spec, workers = args.workers, checkpoint = checkpoint, keep_descriptors = True)
+descriptors = [d[0] for d in descriptors]
+xax = list(rcut_table.rcut)
 
 #Make comparison list
 clipax = xax[1:]
-kerndiffs = average_listcomp(descriptors)
-remkerndiffs = remax_listcomp(descriptors)
+comp_pairs = aligned_pairs(descriptors, rcut_table)
+kerndiffs = average_listcomp(comp_pairs)
+remkerndiffs = remax_listcomp(comp_pairs)
+rcut_table['average'] = [np.nan] + kerndiffs
+rcut_table['rematch'] = [np.nan] + remkerndiffs
     
 plt.plot(clipax, kerndiffs, label = 'Average Kernel')
 plt.plot(clipax, remkerndiffs, label = 'REMatch Kernel')
@@ -174,3 +220,9 @@ plt.legend()
 
 plt.savefig(outputdir+f"/{test_name}_kerstab_nmax={nmax}_lmax = {lmax}.png")
 plt.cla()
+
+#----------------------------------------------------------------------------------------
+#SAVE ALL SWEEP RESULTS AS ONE TABLE (KERNELS COMPARE EACH POINT WITH THE PREVIOUS ONE)
+#----------------------------------------------------------------------------------------
+results = pd.concat([nmax_table.assign(sweep = 'nmax'), lmax_table.assign(sweep = 'lmax'), rcut_table.assign(sweep = 'rcut')])
+results.to_csv(outputdir+f"/{test_name}_sweep.csv", index = False)
@@ -0,0 +1,235 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import sys
+import os
+import json
+import time
+import stat
+import socket
+import signal
+import asyncio
+import argparse
+import io
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from soap_cache import soap_params, get_soap
+from soap_stream import walk_cifs, stream_means
+from soap_kernels import average_vector
+from soap_index import SimilarityIndex
+
+#---------------------------------------------------------------------
+#SIMILARITY SERVER
+#---------------------------------------------------------------------
+
+# A long-lived process that holds the reference set's unit mean vectors and a
+# pool of workers whose SOAP generators are already built, so a query only
+# pays for the new structure's descriptor and one matrix-vector product.
+# Clients send one JSON object per line and get one JSON object back per line:
+#
+#   {"cif": "<CIF text>", "name": "x", "k": 10}  -> {"name": "x", "hits": [[name, score], ...], ...}
+#   {"cif": "<CIF text>", "k": null}             -> {"name": ..., "scores": [...]} in reference order
+#   {"op": "info"} / {"op": "ping"}
+#
+# Failed requests get {"error": "..."} and the connection stays open.
+
+#Build the worker's SOAP generator before the first query arrives
+def _warm(params):
+    import ase.io
+    get_soap(params)
+
+
+#Worker job - parse the CIF text in memory, describe it directly (query
+#structures are one-offs, so they bypass the descriptor cache) and return
+#the structure's mean vector and the seconds it took
+def _query_job(job):
+    cif, params = job
+    from ase.io import read
+    tic = time.perf_counter()
+    mean = average_vector(get_soap(params).create(read(io.StringIO(cif), format = 'cif')))
+    return np.asarray(mean.todense() if hasattr(mean, 'todense') else mean).ravel(), time.perf_counter() - tic
+
+
+class SimilarityServer:
+
+    def __init__(self, index, workers = 2, k = 10):
+        self.index = index
+        self.params = index.params
+        self.workers = workers
+        self.k = k
+        self.pool = None
+        self.served = 0
+
+    #Start the pool and run one warm-up job per worker, so every process has
+    #imported dscribe and built its generator before the first query
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(max_workers = self.workers, initializer = _warm, initargs = (self.params,))
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _warm, self.params) for w in range(self.workers)])
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures = True)
+
+    async def query(self, request):
+        if 'cif' not in request:
+            raise ValueError("request needs 'cif' (CIF text) or 'op'")
+        loop = asyncio.get_running_loop()
+        mean, seconds = await loop.run_in_executor(self.pool, _query_job, (request['cif'], self.params))
+        tic = time.perf_counter()
+        q = mean / np.linalg.norm(mean)
+        k = request.get('k', self.k)
+        reply = {'name': request.get('name')}
+        if k is None:
+            reply['scores'] = (self.index.vectors @ q).tolist()
+        else:
+            idx, sc = self.index.search(q, int(k), exact = request.get('exact', False))
+            reply['hits'] = [[self.index.names[i], float(s)] for i, s in zip(idx, sc)]
+        reply['descriptor_ms'] = seconds * 1e3
+        reply['search_ms'] = (time.perf_counter() - tic) * 1e3
+        self.served += 1
+        return reply
+
+    async def respond(self, request):
+        op = request.get('op', 'query')
+        if op == 'ping':
+            return {'ok': True}
+        if op == 'info':
+            return {'structures': len(self.index.names), 'features': int(self.index.vectors.shape[1]),
+                    'mode': self.index.mode, 'workers': self.workers, 'served': self.served, 'params': self.params}
+        if op == 'query':
+            return await self.query(request)
+        raise ValueError(f"unknown op {op}")
+
+    #One connection may send any number of requests; each is answered in
+    #order, while requests from other connections run concurrently
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = await self.respond(json.loads(line))
+                except Exception as err:
+                    reply = {'error': f"{type(err).__name__}: {err}" if str(err) else type(err).__name__}
+                writer.write((json.dumps(reply) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path = None, host = '127.0.0.1', port = None):
+        await self.start()
+        if path is not None:
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.remove(path)
+            server = await asyncio.start_unix_server(self.handle, path = path, limit = 1 << 26)
+            where = path
+        else:
+            server = await asyncio.start_server(self.handle, host = host, port = port, limit = 1 << 26)
+            where = f"{host}:{port}"
+        stop = asyncio.get_running_loop().create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(sig, stop.cancel)
+        print(f"Serving {len(self.index.names)} reference structures on {where} with {self.workers} workers", flush = True)
+        try:
+            async with server:
+                await stop
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.close()
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+#---------------------------------------------------------------------
+#CLIENT
+#---------------------------------------------------------------------
+
+class SimilarityClient:
+
+    def __init__(self, path = None, host = '127.0.0.1', port = None):
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection((host, port))
+        self.stream = self.sock.makefile('rwb')
+
+    def request(self, request):
+        self.stream.write((json.dumps(request) + '\n').encode())
+        self.stream.flush()
+        reply = json.loads(self.stream.readline())
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def query(self, cif_path, k = 10):
+        with open(cif_path) as f:
+            cif = f.read()
+        return self.request({'cif': cif, 'name': os.path.basename(cif_path)[:-4], 'k': k})
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+#---------------------------------------------------------------------
+#SYSTEM PARAMETERS
+#---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Long-lived AVERAGE kernel similarity server over a reference set, and its client")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    def address_options(p):
+        p.add_argument("--socket", default = None, help = "Unix socket path")
+        p.add_argument("--host", default = "127.0.0.1", help = "TCP host (when no --socket is given)")
+        p.add_argument("--port", type = int, default = 8765, help = "TCP port (when no --socket is given)")
+
+    serve = commands.add_parser("serve", help = "load the reference set and answer queries")
+    serve.add_argument("reference", help = "directory of reference CIF files, or an index file written by soap_query.py build")
+    serve.add_argument("--n", type = int, default = None, help = "number of reference files")
+    serve.add_argument("--workers", type = int, default = 2, help = "processes computing query descriptors")
+    serve.add_argument("--k", type = int, default = 10, help = "default number of neighbours returned")
+    serve.add_argument("--rcut", type = float, default = 20.0)
+    serve.add_argument("--nmax", type = int, default = 16)
+    serve.add_argument("--lmax", type = int, default = 9)
+    serve.add_argument("--species", default = "C,H,O,N", help = "comma separated species list")
+    address_options(serve)
+
+    query = commands.add_parser("query", help = "send CIF files to a running server")
+    query.add_argument("cifs", nargs = "+", help = "structures to look up")
+    query.add_argument("--k", type = int, default = 10, help = "number of neighbours")
+    address_options(query)
+
+    args = parser.parse_args()
+    address = {'path': args.socket, 'host': args.host, 'port': args.port}
+
+    if args.command == "serve":
+        tic_1 = time.perf_counter()
+        if os.path.isdir(args.reference):
+            params = soap_params(species = args.species.split(","), rcut = args.rcut, nmax = args.nmax, lmax = args.lmax, periodic = True, sparse = False)
+            names, means = zip(*stream_means(walk_cifs(args.reference, args.n), params, workers = args.workers))
+            index = SimilarityIndex(names, means, params = params, mode = "exact")
+        elif os.path.isfile(args.reference):
+            index = SimilarityIndex.load(args.reference)
+        else:
+            print("Reference must be a directory or an index file!")
+            sys.exit()
+        print(f"Loaded {len(index.names)} reference structures in {time.perf_counter() - tic_1:.2f} seconds")
+        asyncio.run(SimilarityServer(index, workers = args.workers, k = args.k).serve(**address))
+
+    else:
+        client = SimilarityClient(**address)
+        for cif in args.cifs:
+            tic_1 = time.perf_counter()
+            reply = client.query(cif, k = args.k)
+            toc_1 = time.perf_counter()
+            print(f"# {reply['name']}: descriptor {reply['descriptor_ms']:.1f} ms, search {reply['search_ms']:.2f} ms, "
+                  f"round trip {(toc_1 - tic_1) * 1e3:.1f} ms")
+            for name, score in reply['hits']:
+                print(f"{name}\t{score:.6f}")
+        client.close()
@@ -0,0 +1,288 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import sys
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import contextlib
+import subprocess
+import numpy as np
+from ase.io import read
+from soap_cache import soap_params, params_id
+from soap_parallel import create_descriptors
+from soap_stream import walk_cifs, structure_name
+from soap_kernels import average_vectors, unit_means
+from soap_output import FORMATS, missing_dependency, save_kernel
+
+#---------------------------------------------------------------------
+#SHARDED KERNEL COMPUTATION
+#---------------------------------------------------------------------
+
+# A work directory holds manifest.json and the task results. The structure
+# list is cut into chunks of `block` files: one 'means' task per chunk
+# computes the chunk's mean vectors, and one 'block' task per chunk pair
+# (i <= j) computes that tile of the kernel once both chunks' means exist.
+# Workers - on this host or any host sharing the directory - claim a task by
+# creating claims/<task>.lock with O_EXCL. Results are written to a temporary
+# name and renamed, so a result file that exists is complete. While a task
+# runs, its worker touches the claim every stale / 4 seconds, so a claim
+# whose mtime is older than `stale` seconds belongs to a dead worker and is
+# taken over, however long the task itself takes. A task that fails releases
+# its claim, so a rerun after the cause is fixed picks it up at once.
+
+def manifest_path(workdir):
+    return os.path.join(workdir, 'manifest.json')
+
+
+def result_path(workdir, task):
+    return os.path.join(workdir, 'results', task['id'] + '.npy')
+
+
+def claim_path(workdir, task):
+    return os.path.join(workdir, 'claims', task['id'] + '.lock')
+
+
+#Write the manifest: files, names, SOAP parameters and the task list
+def plan(workdir, files, params, block = 512):
+    chunks = [(i0, min(i0 + block, len(files))) for i0 in range(0, len(files), block)]
+    tasks = [{'id': f'means_{c:05d}', 'kind': 'means', 'start': a, 'stop': b} for c, (a, b) in enumerate(chunks)]
+    tasks += [{'id': f'block_{i:05d}_{j:05d}', 'kind': 'block', 'i': i, 'j': j,
+               'needs': [f'means_{i:05d}', f'means_{j:05d}']}
+              for i in range(len(chunks)) for j in range(i, len(chunks))]
+
+    for sub in ('results', 'claims'):
+        os.makedirs(os.path.join(workdir, sub), exist_ok = True)
+    manifest = {'files': [os.path.abspath(f) for f in files], 'names': [structure_name(f) for f in files],
+                'params': params, 'block': block, 'chunks': chunks, 'tasks': tasks}
+    tmp = manifest_path(workdir) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_path(workdir))
+    return manifest
+
+
+def load_manifest(workdir):
+    with open(manifest_path(workdir)) as f:
+        return json.load(f)
+
+
+def is_done(workdir, task):
+    return os.path.exists(result_path(workdir, task))
+
+
+#Try to take a task. An existing claim is only broken once it is stale
+def claim(workdir, task, stale = 3600):
+    path = claim_path(workdir, task)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return False
+        if age < stale:
+            return False
+        #Rename first so only one of several reclaiming workers wins
+        try:
+            os.replace(path, f'{path}.{socket.gethostname()}.{os.getpid()}.stale')
+        except OSError:
+            return False
+        return claim(workdir, task, stale)
+    with os.fdopen(fd, 'w') as f:
+        f.write(f'{socket.gethostname()} {os.getpid()} {time.time()}\n')
+    return True
+
+
+#Drop this worker's claim on a task, unless another worker has since taken
+#it over
+def release(workdir, task):
+    path = claim_path(workdir, task)
+    try:
+        with open(path) as f:
+            owner = f.read().split()[:2]
+        if owner == [socket.gethostname(), str(os.getpid())]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+#Keep a claim fresh while its task runs, by touching it every interval
+#seconds from a background thread
+@contextlib.contextmanager
+def heartbeat(path, interval):
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    thread = threading.Thread(target = beat, daemon = True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def save_result(workdir, task, array):
+    path = result_path(workdir, task)
+    tmp = f'{path}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def run_task(workdir, manifest, task):
+    if task['kind'] == 'means':
+        files = manifest['files'][task['start']:task['stop']]
+        descriptors = create_descriptors([read(f) for f in files], files, manifest['params'])[0]
+        save_result(workdir, task, average_vectors(descriptors))
+    else:
+        first = np.load(os.path.join(workdir, 'results', task['needs'][0] + '.npy'))
+        second = np.load(os.path.join(workdir, 'results', task['needs'][1] + '.npy'))
+        save_result(workdir, task, unit_means(first) @ unit_means(second).T)
+
+
+#Claim and run tasks until every task has a result. Block tasks wait for
+#their mean vectors; when nothing is claimable the worker polls
+def work(workdir, poll = 2.0, stale = 3600):
+    manifest = load_manifest(workdir)
+    tasks = {t['id']: t for t in manifest['tasks']}
+    completed = 0
+    while True:
+        remaining = [t for t in tasks.values() if not is_done(workdir, t)]
+        if not remaining:
+            return completed
+        progressed = False
+        for task in remaining:
+            if any(not is_done(workdir, tasks[n]) for n in task.get('needs', [])):
+                continue
+            if is_done(workdir, task) or not claim(workdir, task, stale):
+                continue
+            try:
+                with heartbeat(claim_path(workdir, task), stale / 4):
+                    run_task(workdir, manifest, task)
+            except BaseException:
+                release(workdir, task)
+                raise
+            completed += 1
+            progressed = True
+        if not progressed:
+            time.sleep(poll)
+
+
+#Assemble the block results into the full symmetric kernel
+def merge(workdir):
+    manifest = load_manifest(workdir)
+    missing = [t['id'] for t in manifest['tasks'] if not is_done(workdir, t)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} tasks have no result yet, e.g. {missing[0]}")
+    chunks = manifest['chunks']
+    n = len(manifest['files'])
+    kern = np.empty((n, n))
+    for task in manifest['tasks']:
+        if task['kind'] != 'block':
+            continue
+        (a0, a1), (b0, b1) = chunks[task['i']], chunks[task['j']]
+        tile = np.load(result_path(workdir, task))
+        kern[a0:a1, b0:b1] = tile
+        kern[b0:b1, a0:a1] = tile.T
+    return kern, manifest['names']
+
+#---------------------------------------------------------------------
+#SYSTEM PARAMETERS
+#---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sharded AVERAGE kernel: plan block tasks, run workers on any number of hosts, merge")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    def soap_options(p):
+        p.add_argument("--block", type = int, default = 512, help = "structures per chunk (kernel tiles are block x block)")
+        p.add_argument("--rcut", type = float, default = 20.0)
+        p.add_argument("--nmax", type = int, default = 16)
+        p.add_argument("--lmax", type = int, default = 9)
+        p.add_argument("--species", default = "C,H,O,N", help = "comma separated species list")
+
+    p_plan = commands.add_parser("plan", help = "write the manifest for the first n CIF files of a directory")
+    p_plan.add_argument("inputdir", help = "input directory of CIF files")
+    p_plan.add_argument("workdir", help = "shared work directory")
+    p_plan.add_argument("n", type = int, help = "number of files")
+    soap_options(p_plan)
+
+    p_work = commands.add_parser("work", help = "claim and run tasks until none are left")
+    p_work.add_argument("workdir", help = "shared work directory")
+    p_work.add_argument("--poll", type = float, default = 2.0, help = "seconds to wait when no task is ready")
+    p_work.add_argument("--stale", type = float, default = 3600, help = "seconds after which an unfinished claim is taken over")
+
+    p_merge = commands.add_parser("merge", help = "assemble the kernel from the block results")
+    p_merge.add_argument("workdir", help = "shared work directory")
+    p_merge.add_argument("outputdir", help = "output directory")
+    p_merge.add_argument("--format", choices = FORMATS, default = "csv", help = "output format of the comparison kernel")
+
+    p_run = commands.add_parser("run", help = "plan, run local worker processes and merge")
+    p_run.add_argument("inputdir", help = "input directory of CIF files")
+    p_run.add_argument("workdir", help = "work directory")
+    p_run.add_argument("outputdir", help = "output directory")
+    p_run.add_argument("n", type = int, help = "number of files")
+    p_run.add_argument("--workers", type = int, default = 2, help = "local worker processes")
+    p_run.add_argument("--format", choices = FORMATS, default = "csv", help = "output format of the comparison kernel")
+    soap_options(p_run)
+
+    args = parser.parse_args()
+    if missing_dependency(getattr(args, 'format', None)):
+        parser.error(missing_dependency(args.format))
+
+    if args.command in ("merge", "run") and not os.path.isdir(args.outputdir):
+        print("Output parameter must be a directory!")
+        sys.exit()
+
+    def write_kernel(workdir, outputdir, fmt):
+        kern, names = merge(workdir)
+        rcut = load_manifest(workdir)['params']['rcut']
+        print(f"Wrote {save_kernel(kern, names, outputdir + '/soap_comparison_rcut = %s' % rcut, fmt = fmt)}")
+
+    if args.command in ("plan", "run"):
+        if not os.path.isdir(args.inputdir):
+            print("First parameter must be a directory!")
+            sys.exit()
+        params = soap_params(species = args.species.split(","), rcut = args.rcut, nmax = args.nmax, lmax = args.lmax, periodic = True, sparse = False)
+        files = [os.path.abspath(f) for f in walk_cifs(args.inputdir, args.n)]
+        # An existing identical plan is resumed, results of a different one
+        # would not fit the new task list
+        if os.path.exists(manifest_path(args.workdir)):
+            old = load_manifest(args.workdir)
+            if (old['files'], old['block'], params_id(old['params'])) != (files, args.block, params_id(params)):
+                print("Work directory holds a different plan!")
+                sys.exit()
+            manifest = old
+        else:
+            manifest = plan(args.workdir, files, params, block = args.block)
+        done = sum(is_done(args.workdir, t) for t in manifest['tasks'])
+        print(f"Planned {len(manifest['tasks'])} tasks over {len(manifest['files'])} structures in {args.workdir}, {done} already done")
+
+    if args.command == "work":
+        tic_1 = time.perf_counter()
+        completed = work(args.workdir, poll = args.poll, stale = args.stale)
+        print(f"Worker {socket.gethostname()}:{os.getpid()} completed {completed} tasks in {time.perf_counter() - tic_1:.2f} seconds")
+    elif args.command == "merge":
+        write_kernel(args.workdir, args.outputdir, args.format)
+    elif args.command == "run":
+        tic_1 = time.perf_counter()
+        procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "work", args.workdir, "--poll", "0.2"])
+                 for w in range(args.workers)]
+        codes = [p.wait() for p in procs]
+        if any(codes):
+            print("A worker failed, rerun to finish the remaining tasks")
+            sys.exit(1)
+        write_kernel(args.workdir, args.outputdir, args.format)
+        print(f"Took {time.perf_counter() - tic_1:.2f} seconds on {args.workers} local workers")
@@ -0,0 +1,106 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import functools
+import numpy as np
+from ase.data import atomic_numbers
+
+#---------------------------------------------------------------------
+#POWER SPECTRUM LAYOUT
+#---------------------------------------------------------------------
+
+# dscribe (crossover = True) lays the power spectrum out as one block per
+# species pair (Z1 <= Z2, ordered by atomic number, row-major). Inside a
+# block l is the slowest index, followed by the radial pairs (n1, n2), with
+# n1 <= n2 when both species are the same. The radial basis for a given l
+# does not depend on lmax, so a lower-lmax spectrum is exactly the first
+# (l + 1) slices of every block of a higher-lmax one - not a prefix of the
+# whole vector. The radial basis does depend on nmax: dscribe orthonormalises
+# a new set of functions for every nmax, so equal labels at two nmax values
+# name different quantities and only lmax layouts can be lined up.
+
+def _ordered(species):
+    return tuple(sorted(set(species), key = lambda s: atomic_numbers[s]))
+
+
+#(Z1, Z2, l, n1, n2) label of every feature, in dscribe's order
+@functools.lru_cache(maxsize = None)
+def _labels(species, nmax, lmax):
+    z = [atomic_numbers[s] for s in species]
+    labels = []
+    for i in range(len(z)):
+        for j in range(i, len(z)):
+            radial = [(n1, n2) for n1 in range(nmax) for n2 in range(n1 if i == j else 0, nmax)]
+            for l in range(lmax + 1):
+                labels += [(z[i], z[j], l, n1, n2) for n1, n2 in radial]
+    return labels
+
+
+def feature_labels(species, nmax, lmax):
+    return _labels(_ordered(species), int(nmax), int(lmax))
+
+
+#Indices of an (nmax, lmax) descriptor's features inside an (nmax, lmax_big)
+#descriptor of the same species
+@functools.lru_cache(maxsize = None)
+def _lmax_indices(species, nmax, lmax_big, lmax):
+    n = len(species)
+    idx = []
+    start = 0
+    for i in range(n):
+        for j in range(i, n):
+            per_l = nmax * (nmax + 1) // 2 if i == j else nmax * nmax
+            idx.append(start + np.arange((lmax + 1) * per_l))
+            start += (lmax_big + 1) * per_l
+    return np.concatenate(idx)
+
+
+def lmax_indices(species, nmax, lmax_big, lmax):
+    return _lmax_indices(_ordered(species), int(nmax), int(lmax_big), int(lmax))
+
+
+#Lower-lmax descriptor cut out of a descriptor computed at lmax_big
+def slice_lmax(desc, species, nmax, lmax_big, lmax):
+    if lmax == lmax_big:
+        return desc
+    return np.asarray(desc)[:, lmax_indices(species, nmax, lmax_big, lmax)]
+
+
+#Indices of the features belonging to the given (Z1, Z2) pair blocks, i.e.
+#the compact layout that leaves out blocks of species never found together
+@functools.lru_cache(maxsize = None)
+def _pair_indices(species, nmax, lmax, pairs):
+    keep = set(pairs)
+    return np.array([k for k, label in enumerate(_labels(species, nmax, lmax)) if label[:2] in keep])
+
+
+def pair_indices(species, nmax, lmax, pairs):
+    return _pair_indices(_ordered(species), int(nmax), int(lmax), tuple(sorted(tuple(p) for p in pairs)))
+
+
+#Descriptor placed into the larger lmax_to layout of the same nmax, with
+#zeros for the angular channels its own layout does not have
+def embed_features(desc, species, nmax, lmax, nmax_to, lmax_to):
+    if nmax != nmax_to:
+        raise ValueError(f"features at nmax {nmax} and {nmax_to} use different radial bases and cannot be lined up")
+    if lmax == lmax_to:
+        return np.asarray(desc)
+    where = {label: k for k, label in enumerate(feature_labels(species, nmax_to, lmax_to))}
+    idx = np.array([where[label] for label in feature_labels(species, nmax, lmax)])
+    desc = np.asarray(desc)
+    full = np.zeros((desc.shape[0], len(where)), dtype = desc.dtype)
+    full[:, idx] = desc
+    return full
+
+
+#Two descriptors at the same nmax and neighbouring lmax values in the larger
+#lmax layout, zero-padding the smaller one, so the angular channels added by
+#the larger lmax count in the comparison. Across nmax there is no common
+#layout (see soap_converge.environment_match), so that raises ValueError
+def padded_pair(first, second, species, nmax_a, lmax_a, nmax_b, lmax_b):
+    if nmax_a != nmax_b:
+        raise ValueError(f"cannot pair descriptors at nmax {nmax_a} and {nmax_b}: the radial basis differs")
+    lmax = max(lmax_a, lmax_b)
+    return (embed_features(first, species, nmax_a, lmax_a, nmax_a, lmax),
+            embed_features(second, species, nmax_b, lmax_b, nmax_b, lmax))
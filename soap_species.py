@@ -0,0 +1,60 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import re
+import gemmi
+from ase.data import atomic_numbers
+from soap_slicer import _ordered
+
+#---------------------------------------------------------------------
+#DATASET-WIDE SPECIES DISCOVERY
+#---------------------------------------------------------------------
+
+# One pass over the CIF text (gemmi's parser, no structure building or
+# symmetry expansion) collects the elements of every file. The SOAP species
+# are the union over the dataset, and a species pair can only have non-zero
+# power spectrum features in structures that contain both species, so pairs
+# that never share a structure can be dropped from every descriptor without
+# changing any kernel value.
+
+#Element symbol from a type symbol or label such as 'O2-', 'Cl1' or 'H12A'
+def element_symbol(value):
+    letters = re.match(r'[A-Za-z]{1,2}', value)
+    if letters is None:
+        return None
+    symbol = letters.group(0).capitalize()
+    if symbol not in atomic_numbers:
+        symbol = symbol[0]
+    return symbol if symbol in atomic_numbers else None
+
+
+#Elements listed in the atom_site loop of a CIF (type symbols, falling back
+#to site labels)
+def cif_elements(path):
+    block = gemmi.cif.read_file(path)[0]
+    values = block.find_values('_atom_site_type_symbol')
+    if not len(values):
+        values = block.find_values('_atom_site_label')
+    symbols = {element_symbol(gemmi.cif.as_string(v)) for v in values}
+    symbols.discard(None)
+    return symbols
+
+
+#Global species (ordered by atomic number) and the sorted (Z1, Z2) pairs,
+#Z1 <= Z2, that occur together in at least one file
+def discover_species(paths):
+    species = set()
+    pairs = set()
+    for path in paths:
+        elements = cif_elements(path)
+        species |= elements
+        z = sorted(atomic_numbers[s] for s in elements)
+        pairs |= {(a, b) for i, a in enumerate(z) for b in z[i:]}
+    return list(_ordered(species)), sorted(pairs)
+
+
+#Every (Z1, Z2) pair block of the full layout for these species
+def all_pairs(species):
+    z = [atomic_numbers[s] for s in _ordered(species)]
+    return [(a, b) for i, a in enumerate(z) for b in z[i:]]
@@ -4,29 +4,30 @@
 
 import sys
 import os
-import gemmi
-import time
-import pandas as pd
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-from dscribe.descriptors import SOAP
-from dscribe.kernels import AverageKernel
-from dscribe.kernels import REMatchKernel
-from ase import Atoms
-from ase.io import read
-from sklearn.preprocessing import normalize
+from soap_sweep import run_sweep
+from soap_species import discover_species
+from soap_structures import load_structures
+from soap_checkpoint import Checkpoint
 
 #---------------------------------------------------------------------
 #SYSTEM PARAMETERS
 #---------------------------------------------------------------------
 
 # Check parameters
-if (len(sys.argv) != 4):
-    print("I require an input directory!")
-    sys.exit()
-testfile = sys.argv[1]
-compfile = sys.argv[2]
-outputdir = sys.argv[3]
+parser = argparse.ArgumentParser(description = "AVERAGE and REMatch kernel stability between two structures across rcut, nmax and lmax")
+parser.add_argument("testfile", help = "first CIF file")
+parser.add_argument("compfile", help = "second CIF file")
+parser.add_argument("outputdir", help = "output directory")
+parser.add_argument("--workers", type = int, default = 1, help = "processes used to run grid points")
+parser.add_argument("--checkpoint", default = None, help = "directory where every finished sweep point is saved")
+parser.add_argument("--resume", action = "store_true", help = "skip sweep points already saved in the checkpoint")
+parser.add_argument("--species", default = "C,H,O,N", help = "comma separated SOAP species, or 'auto' to collect them from the two files")
+args = parser.parse_args()
+testfile = args.testfile
+compfile = args.compfile
+outputdir = args.outputdir
 
 
 # Check that input file is appropriate
@@ -49,44 +50,35 @@ comp_filename_split = compfile.split("/")
 test_name = test_filename_split[-1][:-4]
 comp_name = comp_filename_split[-1][:-4]
 
-structures = [read(testfile), read(compfile)]
+files = [testfile, compfile]
+structures = load_structures(files)
+
+#Finished sweep points are saved as they complete and skipped on --resume
+checkpoint = None
+if args.checkpoint:
+    checkpoint = Checkpoint(args.checkpoint, {'script': 'soap_stability_test.py', 'files': [os.path.abspath(f) for f in files]}, resume = args.resume)
 
-species = ['C', 'H', 'O', 'N']
+species = discover_species(files)[0] if args.species == "auto" else args.species.split(",")
 #----------------------------------------------------------------------------------------
 #RUN SOAP ACROSS RANGE OF NMAX VALUES AND CALCULATE DIFFERENCE BETWEEN FIRST TERM OF DESCRIPTOR
 #----------------------------------------------------------------------------------------   
+#pandas and matplotlib are only needed once the sweep runs
+import pandas as pd
+import matplotlib.pyplot as plt
+
 xax = [i for i in range(1,15)]
 lmax = 4
 rcut = 20.0
 
-descdiffs = []
-kerndiffs = []
-remkerndiffs = []
-ctime = []
-rectime=[]
-allkerndiffs = []
-
-for nmax in range(1,15):
-    soapgen_rcut = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = 'gto')
-    descriptors = [soapgen_rcut.create(i) for i in structures]
-    descdiffs.append(descriptors[1][0][0] - descriptors[0][0][0])
-
-    tic_1 = time.perf_counter()
-    re = AverageKernel(metric = 'linear')
-    kern = re.create(descriptors)
-    toc_1 = time.perf_counter()
-    ctime.append(toc_1-tic_1)
-    kerndiffs.append(kern[0][1])
-
-    tic_2 = time.perf_counter()
-    normed = [normalize(i) for i in descriptors]
-    rem = REMatchKernel(metric = 'rbf', gamma = 1,alpha = 1, threshold = 1e-6)
-    remkern = rem.create(descriptors)
-    toc_2 = time.perf_counter()
-    rectime.append(toc_2-tic_2)
-    remkerndiffs.append(remkern[0][1])
-
-    allkerndiffs.append(abs(remkern[0][1] - kern[0][1]))
+spec = {'axes': {'nmax': range(1,15)}, 'fixed': {'lmax': lmax, 'rcut': rcut}, 'kernels': ['average', 'rematch'], 'species': species}
+nmax_table = run_sweep(structures, files, spec, workers = args.workers, checkpoint = checkpoint)
+
+descdiffs = list(nmax_table.descdiff)
+kerndiffs = list(nmax_table.average)
+remkerndiffs = list(nmax_table.rematch)
+ctime = list(nmax_table.average_time)
+rectime = list(nmax_table.rematch_time)
+allkerndiffs = list(abs(nmax_table.rematch - nmax_table.average))
     
 plt.plot(xax, ctime, label = 'Average Kernel')
 plt.plot(xax, rectime, label = 'REMatch Kernel')
@@ -124,34 +116,15 @@ xax = [i for i in range(1,10)]
 nmax = 4
 rcut = 20.0
 
-descdiffs = []
-kerndiffs = []
-remkerndiffs = []
-ctime = []
-rectime=[]
-allkerndiffs = []
-
-for lmax in range(1,10):
-    soapgen_rcut = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = 'gto')
-    descriptors = [soapgen_rcut.create(i) for i in structures]
-    descdiffs.append(descriptors[1][0][0] - descriptors[0][0][0])
-
-    tic_1 = time.perf_counter()
-    re = AverageKernel(metric = 'linear')
-    kern = re.create(descriptors)
-    toc_1 = time.perf_counter()
-    ctime.append(toc_1-tic_1)
-    kerndiffs.append(kern[0][1])
-
-    tic_2 = time.perf_counter()
-    normed = [normalize(i) for i in descriptors]
-    rem = REMatchKernel(metric = 'rbf', gamma = 1,alpha = 1, threshold = 1e-6)
-    remkern = rem.create(descriptors)
-    toc_2 = time.perf_counter()
-    rectime.append(toc_2-tic_2)
-    remkerndiffs.append(remkern[0][1])
-
-    allkerndiffs.append(abs(remkern[0][1] - kern[0][1]))
+spec = {'axes': {'lmax': range(1,10)}, 'fixed': {'nmax': nmax, 'rcut': rcut}, 'kernels': ['average', 'rematch'], 'species': species, 'slice_lmax': True}
+lmax_table = run_sweep(structures, files, spec, workers = args.workers, checkpoint = checkpoint)
+
+descdiffs = list(lmax_table.descdiff)
+kerndiffs = list(lmax_table.average)
+remkerndiffs = list(lmax_table.rematch)
+ctime = list(lmax_table.average_time)
+rectime = list(lmax_table.rematch_time)
+allkerndiffs = list(abs(lmax_table.rematch - lmax_table.average))
     
 plt.plot(xax, ctime, label = 'Average Kernel')
 plt.plot(xax, rectime, label = 'REMatch Kernel')
@@ -189,35 +162,16 @@ nmax = 4
 lmax = 4
 xax = []
 
-descdiffs = []
-kerndiffs = []
-remkerndiffs = []
-ctime = []
-rectime=[]
-allkerndiffs = []
-
-for rcut in np.linspace(2,15,20):
-    xax.append(rcut)
-    soapgen_rcut = SOAP(species = species, rcut = rcut, nmax = nmax, lmax = lmax, periodic= True, sparse = False, rbf = 'gto')
-    descriptors = [soapgen_rcut.create(i) for i in structures]
-    descdiffs.append(descriptors[1][0][0] - descriptors[0][0][0])
-
-    tic_1 = time.perf_counter()
-    re = AverageKernel(metric = 'linear')
-    kern = re.create(descriptors)
-    toc_1 = time.perf_counter()
-    ctime.append(toc_1-tic_1)
-    kerndiffs.append(kern[0][1])
-
-    tic_2 = time.perf_counter()
-    normed = [normalize(i) for i in descriptors]
-    rem = REMatchKernel(metric = 'rbf', gamma = 1,alpha = 1, threshold = 1e-6)
-    remkern = rem.create(descriptors)
-    toc_2 = time.perf_counter()
-    rectime.append(toc_2-tic_2)
-    remkerndiffs.append(remkern[0][1])
-
-    allkerndiffs.append(abs(remkern[0][1] - kern[0][1]))
+spec = {'axes': {'rcut': np.linspace(2,15,20)}, 'fixed': {'nmax': nmax, 'lmax': lmax}, 'kernels': ['average', 'rematch'], 'species': species}
+rcut_table = run_sweep(structures, files, spec, workers = args.workers, checkpoint = checkpoint)
+xax = list(rcut_table.rcut)
+
+descdiffs = list(rcut_table.descdiff)
+kerndiffs = list(rcut_table.average)
+remkerndiffs = list(rcut_table.rematch)
+ctime = list(rcut_table.average_time)
+rectime = list(rcut_table.rematch_time)
+allkerndiffs = list(abs(rcut_table.rematch - rcut_table.average))
     
 plt.plot(xax, ctime, label = 'Average Kernel')
 plt.plot(xax, rectime, label = 'REMatch Kernel')
@@ -246,3 +200,9 @@ plt.legend()
 
 plt.savefig(outputdir+f"/{test_name}_{comp_name}_kernmatch_nmax={nmax}_lmax = {lmax}.png")
 plt.cla()
+
+#----------------------------------------------------------------------------------------
+#SAVE ALL SWEEP RESULTS AS ONE TABLE
+#----------------------------------------------------------------------------------------
+results = pd.concat([nmax_table.assign(sweep = 'nmax'), lmax_table.assign(sweep = 'lmax'), rcut_table.assign(sweep = 'rcut')])
+results.to_csv(outputdir+f"/{test_name}_{comp_name}_sweep.csv", index = False)
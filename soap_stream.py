@@ -0,0 +1,103 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import time
+import queue
+import threading
+import itertools
+import gemmi
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from soap_cache import create_soap, get_soap, params_dtype, descriptor_bytes
+from soap_kernels import average_vector
+from soap_symmetry import site_weights
+
+#---------------------------------------------------------------------
+#PIPELINE STAGES
+#---------------------------------------------------------------------
+
+#Walk the input directory lazily, stopping after n files
+def walk_cifs(inputdir, n = None):
+    return itertools.islice(gemmi.CifWalk(inputdir), n)
+
+
+def structure_name(path):
+    return os.path.basename(path)[:-4]
+
+
+#Parse files in a background thread, keeping at most `prefetch` structures
+#read ahead of the consumer so file I/O overlaps with SOAP computation
+def prefetch_structures(paths, prefetch = 8):
+    buffer = queue.Queue(maxsize = max(1, prefetch))
+    done = object()
+
+    def reader():
+        from ase.io import read
+        try:
+            for path in paths:
+                buffer.put((path, read(path)))
+        except Exception as err:
+            buffer.put(err)
+        buffer.put(done)
+
+    threading.Thread(target = reader, daemon = True).start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+#Worker job - compute the descriptor and reduce it straight away so only the
+#mean vector leaves the worker, together with a timing record for tracing
+#(as soap_parallel.create_descriptors keeps them)
+def _mean_job(job):
+    structure, path, params = job
+    start = time.time()
+    tic = time.perf_counter()
+    cpu = time.process_time()
+    desc = create_soap(structure, path, params)
+    mean = average_vector(desc, site_weights(structure, path, params))
+    return mean, {'path': path, 'atoms': len(structure), 'bytes': descriptor_bytes(desc), 'cpu': time.process_time() - cpu,
+                  'start': start, 'wall': time.perf_counter() - tic, 'pid': os.getpid()}
+
+
+#Yield (name, mean vector) for each CIF in order. Full descriptors exist
+#only while in flight: at most 2 x workers structures at once, and no more
+#than memory_limit bytes of estimated descriptor output (one structure is
+#always allowed through so an oversized crystal cannot stall the stream).
+#A timings list, if given, is extended with one record per structure
+def stream_means(paths, params, workers = 1, prefetch = 8, memory_limit = None, timings = None):
+    row_bytes = get_soap(params).get_number_of_features() * params_dtype(params).itemsize
+    parsed = prefetch_structures(paths, prefetch)
+
+    def result(path, done):
+        mean, timing = done
+        if timings is not None:
+            timings.append(timing)
+        return structure_name(path), mean
+
+    if workers <= 1:
+        for path, structure in parsed:
+            yield result(path, _mean_job((structure, path, params)))
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        pending = deque()
+        in_flight = 0
+        for path, structure in parsed:
+            nbytes = len(structure) * row_bytes
+            while pending and (len(pending) >= 2 * workers or
+                               (memory_limit is not None and in_flight + nbytes > memory_limit)):
+                done_path, done_bytes, fut = pending.popleft()
+                in_flight -= done_bytes
+                yield result(done_path, fut.result())
+            pending.append((path, nbytes, pool.submit(_mean_job, (structure, path, params))))
+            in_flight += nbytes
+        while pending:
+            done_path, done_bytes, fut = pending.popleft()
+            yield result(done_path, fut.result())
@@ -0,0 +1,185 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from ase import Atoms
+from soap_cache import file_digest
+
+#---------------------------------------------------------------------
+#STORE SETTINGS
+#---------------------------------------------------------------------
+
+# Parsed structures are kept under SOAP_STRUCTURE_DIR, one store per set of
+# input directories, so runs over different files of the same directories
+# (another n, a grown directory) share it. Stores beyond SOAP_STRUCTURE_MAX_GB
+# in total are evicted least recently used first. SOAP_STRUCTURES=0 switches
+# the store off and every file is parsed with ase.io.read as before.
+STRUCTURE_DIR = os.environ.get('SOAP_STRUCTURE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'dscribe_tools', 'structures'))
+STRUCTURE_MAX_BYTES = int(float(os.environ.get('SOAP_STRUCTURE_MAX_GB', '2')) * 1024**3)
+STRUCTURES_ENABLED = os.environ.get('SOAP_STRUCTURES', '1') != '0'
+
+#---------------------------------------------------------------------
+#BINARY STRUCTURE STORE
+#---------------------------------------------------------------------
+
+# A store is a directory of contiguous arrays: the atomic numbers and
+# positions of all structures back to back, offsets[i]:offsets[i+1] marking
+# structure i, and one cell and pbc row per structure. index.json records the
+# names, paths, sizes, mtimes and content hashes of the source files. Arrays
+# are memory-mapped, and Atoms are only built when a structure is asked for.
+# A store opened for a list of files is a view of just those entries, in
+# that order; entries of other files in the same directories stay stored.
+
+ARRAYS = ['numbers', 'positions', 'offsets', 'cells', 'pbc']
+
+
+class StructureStore:
+
+    #Raises KeyError when one of the files is not in the store
+    def __init__(self, path, files = None):
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            self.index = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r'))
+        where = {p: r for r, p in enumerate(self.index['paths'])}
+        self.rows = list(range(len(where))) if files is None else [where[os.path.abspath(f)] for f in files]
+        self.names = [self.index['names'][r] for r in self.rows]
+        self.paths = [self.index['paths'][r] for r in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._atoms(self.rows[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def _atoms(self, r):
+        a, b = self.offsets[r], self.offsets[r + 1]
+        return Atoms(numbers = self.numbers[a:b], positions = self.positions[a:b],
+                     cell = self.cells[r], pbc = self.pbc[r])
+
+    #Source files whose size and mtime are unchanged, or whose content hash
+    #still matches, keep their entry
+    def _valid(self, r):
+        path = self.index['paths'][r]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if [st.st_size, st.st_mtime_ns] == self.index['stamps'][r]:
+            return True
+        return file_digest(path) == self.index['digests'][r]
+
+    def valid(self, i):
+        return self._valid(self.rows[i])
+
+    #Write a store for the given files, taking still-valid structures from an
+    #existing store and parsing the rest. Valid entries of the old store for
+    #other files are carried over for later runs. The new directory replaces
+    #the old one in one rename; the returned store is a view of the files
+    @classmethod
+    def build(cls, path, files, old = None):
+        from ase.io import read
+        known = {}
+        if old is not None:
+            known = {p: r for r, p in enumerate(old.index['paths']) if old._valid(r)}
+        paths = [os.path.abspath(f) for f in files]
+        paths += [p for p in known if p not in set(paths)]
+
+        numbers, positions, cells, pbc, stamps, digests = [], [], [], [], [], []
+        for f in paths:
+            atoms = old._atoms(known[f]) if f in known else read(f)
+            st = os.stat(f)
+            numbers.append(atoms.numbers.astype(np.uint8))
+            positions.append(atoms.positions)
+            cells.append(np.array(atoms.cell))
+            pbc.append(atoms.pbc)
+            stamps.append([st.st_size, st.st_mtime_ns])
+            digests.append(file_digest(f))
+
+        tmp = f'{path}.{os.getpid()}.tmp'
+        os.makedirs(tmp, exist_ok = True)
+        arrays = {'numbers': np.concatenate(numbers) if numbers else np.empty(0, np.uint8),
+                  'positions': np.concatenate(positions) if positions else np.empty((0, 3)),
+                  'offsets': np.cumsum([0] + [len(n) for n in numbers]),
+                  'cells': np.array(cells).reshape(-1, 3, 3), 'pbc': np.array(pbc, dtype = bool).reshape(-1, 3)}
+        for name in ARRAYS:
+            np.save(os.path.join(tmp, name + '.npy'), arrays[name])
+        with open(os.path.join(tmp, 'index.json'), 'w') as f:
+            json.dump({'names': [os.path.basename(p)[:-4] for p in paths], 'paths': paths,
+                       'stamps': stamps, 'digests': digests}, f)
+
+        if os.path.exists(path):
+            stale = f'{path}.{os.getpid()}.old'
+            os.replace(path, stale)
+            os.replace(tmp, path)
+            shutil.rmtree(stale, ignore_errors = True)
+        else:
+            os.replace(tmp, path)
+        return cls(path, files)
+
+
+#One store per set of directories the files live in
+def store_path(files, root = STRUCTURE_DIR):
+    dirs = sorted(set(os.path.dirname(os.path.abspath(f)) for f in files))
+    key = hashlib.sha256(json.dumps(dirs).encode()).hexdigest()
+    return os.path.join(root, key[:16])
+
+
+#Remove least recently used stores (by the mtime of their index.json, which
+#every load refreshes) until the root fits in max_bytes; keep is never removed
+def evict_stores(root = STRUCTURE_DIR, keep = None, max_bytes = STRUCTURE_MAX_BYTES):
+    stores = []
+    for entry in os.scandir(root):
+        index = os.path.join(entry.path, 'index.json')
+        if not entry.is_dir() or not os.path.exists(index):
+            continue
+        size = sum(e.stat().st_size for e in os.scandir(entry.path))
+        stores.append((os.path.getmtime(index), size, entry.path))
+    total = sum(s[1] for s in stores)
+    for mtime, size, path in sorted(stores):
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        shutil.rmtree(path, ignore_errors = True)
+        total -= size
+
+
+#Structures for a list of CIF files, in order: straight from the store when
+#every file has a valid entry, otherwise the store is rebuilt (parsing only
+#new or changed files). Returns a plain list of parsed Atoms when the store
+#is switched off
+def load_structures(files, root = STRUCTURE_DIR):
+    if not STRUCTURES_ENABLED:
+        from ase.io import read
+        return [read(f) for f in files]
+    path = store_path(files, root)
+    old = None
+    if os.path.exists(os.path.join(path, 'index.json')):
+        try:
+            old = StructureStore(path)
+        except (OSError, ValueError):
+            old = None
+    if old is not None:
+        try:
+            view = StructureStore(path, files)
+        except KeyError:
+            view = None
+        if view is not None and all(view.valid(i) for i in range(len(view))):
+            os.utime(os.path.join(path, 'index.json'))
+            return view
+    os.makedirs(root, exist_ok = True)
+    store = StructureStore.build(path, files, old)
+    evict_stores(root, keep = path)
+    return store
@@ -0,0 +1,189 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import json
+import time
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from soap_cache import soap_params, params_id, create_soap_timed
+from soap_slicer import slice_lmax
+from soap_neighbours import ExtendedEnvironment, environment_radius
+from soap_rematch import rematch_kernel as batched_rematch
+
+#---------------------------------------------------------------------
+#GRID SPECIFICATION
+#---------------------------------------------------------------------
+
+# A sweep is described by a dictionary:
+#   axes     - {parameter: values} swept as a product, e.g. {'nmax': range(1,10)}
+#   fixed    - {parameter: value} for the remaining SOAP parameters
+#   rbf      - list of radial basis functions (default ['gto'])
+#   kernels  - kernels compared between the first two structures, from KERNELS
+#   species  - SOAP species
+#   periodic - periodic SOAP (default True)
+#   slice_lmax - when sweeping lmax, compute SOAP once at the largest lmax
+#                and cut the lower-lmax spectra out of it (default False,
+#                leave off when the point timings are what is measured)
+#   reuse_neighbours - when sweeping rcut, build each structure's periodic
+#                images once for the largest rcut and serve every point
+#                from them (soap_neighbours.py, default False)
+
+KERNELS = ['average', 'rematch']
+
+
+#Expand a spec into its grid points, axes varying slowest to fastest in the
+#order given and rbf innermost
+def sweep_points(spec):
+    axes = spec.get('axes', {})
+    names = list(axes)
+    points = []
+    for values in itertools.product(*[list(axes[a]) for a in names]):
+        for rbf in spec.get('rbf', ['gto']):
+            point = dict(spec.get('fixed', {}))
+            point.update(zip(names, values))
+            point['rbf'] = rbf
+            points.append(point)
+    return points
+
+#---------------------------------------------------------------------
+#KERNELS
+#---------------------------------------------------------------------
+
+def average_kernel(descriptors):
+    from dscribe.kernels import AverageKernel
+    return AverageKernel(metric = 'linear').create(descriptors)
+
+
+#REMatch on row-normalised descriptors (rbf, gamma = 1, alpha = 1, threshold = 1e-6)
+def rematch_kernel(descriptors):
+    return batched_rematch(descriptors, alpha = 1, gamma = 1, threshold = 1e-6)
+
+
+KERNEL_FUNCTIONS = {'average': average_kernel, 'rematch': rematch_kernel}
+
+#---------------------------------------------------------------------
+#SWEEP ENGINE
+#---------------------------------------------------------------------
+
+_base_descriptors = {}
+
+def _point_params(point, spec):
+    return soap_params(species = spec['species'], rcut = point['rcut'], nmax = point['nmax'], lmax = point['lmax'],
+                       rbf = point['rbf'], periodic = spec.get('periodic', True), sparse = False)
+
+
+#Descriptor at the sweep's largest lmax, kept in memory so every lower-lmax
+#point of the sweep is sliced from one computation. Worker processes do not
+#share this memo, so run_sweep computes the bases in the parent and sends
+#them along with the points
+def _base_descriptor(structure, path, params):
+    key = (os.path.abspath(path), params_id(params))
+    if key not in _base_descriptors:
+        _base_descriptors[key] = np.asarray(create_soap_timed(structure, path, params)[0])
+    return _base_descriptors[key]
+
+
+_environments = {}
+
+#Periodic images of a structure out to the sweep's largest rcut, built once
+#per process and shared by every rcut point
+def _environment(structure, path, params, rcut_max):
+    radius = environment_radius(params, rcut_max)
+    key = (os.path.abspath(path), radius)
+    if key not in _environments:
+        _environments[key] = ExtendedEnvironment(structure, radius)
+    return _environments[key]
+
+
+#Evaluate one grid point: descriptors for every structure, their creation
+#time and length, and each requested kernel between structures 0 and 1.
+#A sliced point may carry its structures' base descriptors as a last item
+def _run_point(job):
+    point, structures, files, spec, keep, lmax_big, *bases = job
+    params = _point_params(point, spec)
+
+    descriptors = []
+    soap_time = 0.0
+    reuse = spec.get('reuse_neighbours') and 'rcut' in spec.get('axes', {}) and params['periodic']
+    if lmax_big is None:
+        for s, f in zip(structures, files):
+            env = _environment(s, f, params, max(spec['axes']['rcut'])) if reuse else None
+            desc, seconds = create_soap_timed(s, f, params, environment = env)
+            descriptors.append(np.asarray(desc))
+            soap_time += seconds
+    else:
+        tic = time.perf_counter()
+        big = dict(params, lmax = lmax_big)
+        for k, (s, f) in enumerate(zip(structures, files)):
+            desc = bases[0][k] if bases else _base_descriptor(s, f, big)
+            descriptors.append(slice_lmax(desc, params['species'], params['nmax'], lmax_big, params['lmax']))
+        soap_time = time.perf_counter() - tic
+
+    row = dict(point)
+    row['time'] = soap_time
+    row['rows'] = len(descriptors[0])
+    row['features'] = len(descriptors[0][0])
+
+    if len(descriptors) > 1:
+        row['descdiff'] = descriptors[1][0][0] - descriptors[0][0][0]
+        for k in spec.get('kernels', []):
+            tic = time.perf_counter()
+            kern = KERNEL_FUNCTIONS[k](descriptors)
+            toc = time.perf_counter()
+            row[k] = kern[0][1]
+            row[k + '_time'] = toc - tic
+
+    return row, (descriptors if keep else None)
+
+
+#Checkpoint key of a grid point: everything its result depends on
+def point_key(job):
+    point, structures, files, spec, keep, lmax_big = job[:6]
+    return json.dumps({'point': point, 'files': [os.path.abspath(f) for f in files], 'species': sorted(spec['species']),
+                       'periodic': spec.get('periodic', True), 'kernels': spec.get('kernels', []),
+                       'keep': keep, 'lmax_big': lmax_big}, sort_keys = True, default = float)
+
+
+#Run every grid point of the spec across a process pool and return one tidy
+#table with a row per point, in grid order. With keep_descriptors the
+#per-point descriptor lists are returned as well. With a checkpoint
+#(soap_checkpoint.Checkpoint) each point is saved as soon as it finishes and
+#points already in the checkpoint are not recomputed
+def run_sweep(structures, files, spec, workers = 1, keep_descriptors = False, checkpoint = None):
+    lmax_big = None
+    if spec.get('slice_lmax') and 'lmax' in spec.get('axes', {}):
+        lmax_big = max(spec['axes']['lmax'])
+    jobs = [(p, structures, files, spec, keep_descriptors, lmax_big) for p in sweep_points(spec)]
+
+    results = [None] * len(jobs)
+    if checkpoint is not None:
+        results = [checkpoint.load(point_key(j)) for j in jobs]
+    pending = [k for k, r in enumerate(results) if r is None]
+
+    def finished(k, result):
+        results[k] = result
+        if checkpoint is not None:
+            checkpoint.save(point_key(jobs[k]), result)
+
+    if workers > 1 and pending:
+        #Each base descriptor is computed once here rather than once per worker
+        if lmax_big is not None:
+            for k in pending:
+                big = dict(_point_params(jobs[k][0], spec), lmax = lmax_big)
+                jobs[k] += ([_base_descriptor(s, f, big) for s, f in zip(structures, files)],)
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            futures = {pool.submit(_run_point, jobs[k]): k for k in pending}
+            for fut in as_completed(futures):
+                finished(futures[fut], fut.result())
+    else:
+        for k in pending:
+            finished(k, _run_point(jobs[k]))
+
+    import pandas as pd
+    table = pd.DataFrame([r[0] for r in results])
+    if keep_descriptors:
+        return table, [r[1] for r in results]
+    return table
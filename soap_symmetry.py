@@ -0,0 +1,75 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import gemmi
+import numpy as np
+
+#---------------------------------------------------------------------
+#SYMMETRY-UNIQUE SITES
+#---------------------------------------------------------------------
+
+# Atoms related by a space-group operation have identical SOAP power spectra
+# (the power spectrum is invariant under rotations, inversion and
+# translations), so SOAP only has to be computed at one representative site
+# per orbit. The structure-averaged descriptor is then the mean over the
+# representatives weighted by their orbit sizes (multiplicities).
+# Operations are taken from the CIF with gemmi and applied to the fractional
+# coordinates of the cell ASE built from the same file. CIFs without symmetry
+# information are treated as P1, i.e. every atom is its own representative.
+
+#Rotation (3 x 3 x ops) and translation parts of the CIF's symmetry operations
+def symmetry_ops(path):
+    small = gemmi.read_small_structure(path)
+    if small.spacegroup is not None:
+        ops = list(small.spacegroup.operations())
+    elif small.symops:
+        ops = [gemmi.Op(s) for s in small.symops]
+    else:
+        ops = [gemmi.Op('x,y,z')]
+    rot = np.array([op.rot for op in ops], dtype = np.float64) / gemmi.Op.DEN
+    tran = np.array([op.tran for op in ops], dtype = np.float64) / gemmi.Op.DEN
+    return rot, tran
+
+
+#Orbit label of every atom (the smallest atom index in its orbit). Images
+#are matched to atoms of the same element within tol in fractional
+#coordinates; images that match nothing (e.g. disorder) are ignored
+def orbit_labels(structure, rot, tran, tol = 1e-3):
+    from scipy.spatial import cKDTree
+    frac = np.mod(structure.get_scaled_positions(wrap = True), 1.0)
+    frac[frac >= 1.0] = 0.0
+    numbers = structure.numbers
+    tree = cKDTree(frac, boxsize = 1.0)
+    labels = np.arange(len(frac))
+    for r, t in zip(rot, tran):
+        images = np.mod(frac @ r.T + t, 1.0)
+        images[images >= 1.0] = 0.0
+        dist, match = tree.query(images, distance_upper_bound = tol)
+        found = np.isfinite(dist)
+        found[found] &= numbers[match[found]] == numbers[found]
+        np.minimum.at(labels, np.flatnonzero(found), match[found])
+    return labels
+
+
+_sites = {}
+
+#(representative atom indices, multiplicities) for the structure read from
+#path, remembered while the file's size and mtime are unchanged
+def unique_sites(structure, path):
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if stamp not in _sites:
+        labels = orbit_labels(structure, *symmetry_ops(path))
+        reps, counts = np.unique(labels, return_counts = True)
+        _sites[stamp] = (reps, counts)
+    return _sites[stamp]
+
+
+#Multiplicities to weight the representative descriptors with, or None when
+#the parameters ask for SOAP on every atom
+def site_weights(structure, path, params):
+    if params.get('sites') != 'unique':
+        return None
+    return unique_sites(structure, path)[1]
@@ -0,0 +1,91 @@
+#---------------------------------------------------------------------
+#PACKAGE IMPORTS
+#---------------------------------------------------------------------
+
+import os
+import json
+import time
+import cProfile
+import resource
+import contextlib
+
+#---------------------------------------------------------------------
+#STAGE TRACER
+#---------------------------------------------------------------------
+
+# A Tracer collects one event per pipeline stage (wall and CPU time, the
+# largest RSS so far and any counts the stage adds, e.g. atoms or descriptor
+# bytes) and one per structure. getrusage only gives the maximum RSS over the
+# life of the calling process, so max_rss_so_far is not a per-stage peak and
+# does not include worker processes. Events are written either as JSON lines or in Chrome trace format
+# (open in chrome://tracing or https://ui.perfetto.dev). Stages named in
+# `profile` additionally run under cProfile, with the stats dumped next to the
+# trace as TRACE.<stage>.prof (only the calling process is profiled).
+
+TRACE_FORMATS = ['jsonl', 'chrome']
+
+
+#Largest resident set size of this process so far, in bytes (ru_maxrss is
+#in kB on Linux)
+def max_rss_so_far():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Tracer:
+    def __init__(self, path = None, fmt = 'jsonl', profile = ()):
+        self.path = path
+        self.fmt = fmt
+        self.profile = set(profile)
+        self.events = []
+
+    #Time the enclosed block. The yielded dictionary is stored with the event,
+    #so the stage can fill in counts it only knows at the end
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        profiler = None
+        if name in self.profile and self.path is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.time()
+        tic = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield fields
+        finally:
+            wall = time.perf_counter() - tic
+            cpu = time.process_time() - cpu
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(f"{self.path}.{name}.prof")
+            self.record(name, start, wall, cpu = cpu, kind = 'stage', max_rss_so_far = max_rss_so_far(), **fields)
+
+    #Add an event measured elsewhere, e.g. per-structure timings from workers
+    def record(self, name, start, wall, kind = 'structure', pid = None, **fields):
+        self.events.append(dict(fields, name = name, kind = kind, start = start, wall = wall, pid = pid or os.getpid()))
+
+    def stages(self):
+        return [e for e in self.events if e['kind'] == 'stage']
+
+    def write(self):
+        if self.path is None:
+            return
+        if self.fmt == 'chrome':
+            self._write_chrome()
+        else:
+            with open(self.path, 'w') as f:
+                for e in self.events:
+                    f.write(json.dumps(e) + '\n')
+
+    #Complete ('X') events in microseconds; stages go on thread 0 of the main
+    #process, structures on the thread of the process that described them
+    def _write_chrome(self):
+        t0 = min((e['start'] for e in self.events), default = 0)
+        main = os.getpid()
+        trace = []
+        for e in self.events:
+            args = {k: v for k, v in e.items() if k not in ('name', 'kind', 'start', 'wall', 'pid')}
+            trace.append({'name': e['name'], 'cat': e['kind'], 'ph': 'X', 'pid': main,
+                          'tid': 0 if e['kind'] == 'stage' else e['pid'],
+                          'ts': (e['start'] - t0) * 1e6, 'dur': e['wall'] * 1e6, 'args': args})
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,52 @@
+#---------------------------------------------------------------------
+#REGRESSION TEST: BATCHED REMATCH AGAINST DSCRIBE'S REMATCHKERNEL
+#---------------------------------------------------------------------
+
+# Run with `python -m pytest test_rematch.py`. Descriptors are random
+# non-negative environment sets of different sizes (like power spectra), so
+# the test needs no CIF files; small batches make the Sinkhorn batching,
+# per-pair convergence and the streamed local kernels all take part.
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import normalize
+from dscribe.kernels import REMatchKernel
+from soap_rematch import rematch_kernel, rematch_pairs, rematch_selected
+
+
+@pytest.fixture(scope = 'module')
+def descriptors():
+    rng = np.random.default_rng(7)
+    return [rng.random((n, 24)) ** 3 for n in (3, 5, 1, 8, 4, 6)]
+
+
+@pytest.fixture(scope = 'module')
+def reference(descriptors):
+    kernel = REMatchKernel(metric = 'rbf', gamma = 1, alpha = 1, threshold = 1e-6)
+    return kernel.create([normalize(d) for d in descriptors])
+
+
+def test_rematch_kernel(descriptors, reference):
+    assert np.allclose(rematch_kernel(descriptors, batch = 4), reference, atol = 1e-8)
+
+
+def test_rematch_pairs(descriptors, reference):
+    first = [descriptors[0], descriptors[2], descriptors[3]]
+    second = [descriptors[1], descriptors[5], descriptors[3]]
+    expected = [reference[0, 1], reference[2, 5], reference[3, 3]]
+    assert np.allclose(rematch_pairs(first, second, batch = 2), expected, atol = 1e-8)
+
+
+def test_rematch_selected(descriptors, reference):
+    pairs = [(0, 4), (1, 3), (2, 5), (4, 5)]
+    expected = [reference[i, j] for i, j in pairs]
+    assert np.allclose(rematch_selected(descriptors, pairs, batch = 3), expected, atol = 1e-8)
+
+
+def test_rematch_multiplicity_weights(descriptors):
+    #Environments repeated k times match the unrepeated ones weighted by k
+    counts = [np.arange(1, len(d) + 1) for d in descriptors]
+    repeated = [np.repeat(d, c, axis = 0) for d, c in zip(descriptors, counts)]
+    pairs = [(0, 1), (2, 3), (4, 5), (1, 4)]
+    expected = rematch_selected(repeated, pairs)
+    assert np.allclose(rematch_selected(descriptors, pairs, weights = counts), expected, atol = 1e-6)